@@ -0,0 +1,23 @@
+# Compact binary ping format shared by UDPPingerClient and UDPPingerServer
+# A ping is a fixed 17 byte header: magic, sequence number, send timestamp and flags
+import struct
+
+MAGIC = b'UPNG'
+# network byte order: 4 byte magic, 32 bit sequence number, 64 bit perf_counter_ns timestamp, 8 bit flags
+HEADER = struct.Struct('!4sIQB')
+
+
+def pack_ping(sequence_number, send_ns, flags=0):
+    return HEADER.pack(MAGIC, sequence_number, send_ns, flags)
+
+
+def is_binary_ping(data):
+    return len(data) >= HEADER.size and data[:4] == MAGIC
+
+
+def unpack_ping(data):
+    # Returns (sequence number, send timestamp in ns, flags), raises ValueError if data is not a binary ping
+    if not is_binary_ping(data):
+        raise ValueError('not a binary ping')
+    magic, sequence_number, send_ns, flags = HEADER.unpack_from(data)
+    return sequence_number, send_ns, flags
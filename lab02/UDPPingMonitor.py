@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import collections
+import datetime
+import heapq
+import json
+import os
+import socket
+import time
+import PingPacket
+
+
+server_port = 12000
+
+
+class Target:
+    # Ping results for one server over a sliding window of the most recent pings
+    def __init__(self, name, host, port, window):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.address = None
+        self.error = None
+        self.results = collections.deque(maxlen=window)   # RTT in seconds, or None for a lost ping
+        self.sent = 0
+        self.received = 0
+        self.consecutive_misses = 0
+        self.last_rtt = None
+        self.down = False
+
+    def reply(self, rtt):
+        self.results.append(rtt)
+        self.received += 1
+        self.last_rtt = rtt
+        self.consecutive_misses = 0
+        if self.down:
+            self.down = False
+            print(f"{timestamp()} {self.name} is UP again (RTT {rtt * 1000:.3f} ms)", flush=True)
+
+    def miss(self, down_after):
+        self.results.append(None)
+        self.consecutive_misses += 1
+        if not self.down and self.consecutive_misses >= down_after:
+            self.down = True
+            print(f"{timestamp()} {self.name} is DOWN after {self.consecutive_misses} missed pings", flush=True)
+
+    def summary(self):
+        rtts = [rtt for rtt in self.results if rtt is not None]
+        lost = len(self.results) - len(rtts)
+        return {
+            "name": self.name,
+            "address": f"{self.address[0]}:{self.address[1]}" if self.address else None,
+            "state": "down" if self.down or self.error else "up",
+            "error": self.error,
+            "sent": self.sent,
+            "received": self.received,
+            "consecutive_misses": self.consecutive_misses,
+            "window": len(self.results),
+            "window_loss_pct": 100 * lost / len(self.results) if self.results else None,
+            "rtt_min_ms": min(rtts) * 1000 if rtts else None,
+            "rtt_avg_ms": sum(rtts) / len(rtts) * 1000 if rtts else None,
+            "rtt_max_ms": max(rtts) * 1000 if rtts else None,
+            "last_rtt_ms": self.last_rtt * 1000 if self.last_rtt is not None else None,
+        }
+
+
+def timestamp():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def read_targets(path, window):
+    # One target per line as host or host:port, blank lines and # comments are ignored
+    targets = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            host, sep, port = line.rpartition(":")
+            if not sep:
+                host, port = line, server_port
+            targets.append(Target(line, host, int(port), window))
+    return targets
+
+
+def write_snapshot(path, targets):
+    # Write to a temporary file and rename it so readers never see half a snapshot
+    snapshot = {
+        "time": timestamp(),
+        "targets_up": sum(1 for t in targets if not (t.down or t.error)),
+        "targets_down": sum(1 for t in targets if t.down or t.error),
+        "targets": [t.summary() for t in targets],
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class MonitorProtocol(asyncio.DatagramProtocol):
+    # One socket for every target, replies are matched by the globally unique sequence number
+    def __init__(self, binary):
+        self.binary = binary
+        self.outstanding = {}   # sequence number -> (target, send time in perf_counter_ns)
+
+    def datagram_received(self, data, addr):
+        receive_ns = time.perf_counter_ns()
+        try:
+            if self.binary:
+                sequence_number, send_ns, flags = PingPacket.unpack_ping(data)
+            else:
+                sequence_number = int(data.split()[1])
+        except (IndexError, ValueError):
+            return
+        pending = self.outstanding.pop(sequence_number, None)
+        if pending is None:
+            # late or duplicated reply
+            return
+        target, send_ns = pending
+        target.reply((receive_ns - send_ns) / 1e9)
+
+    def error_received(self, exc):
+        # e.g. ICMP port unreachable, the ping will simply time out
+        pass
+
+
+async def monitor(targets, interval, timeout_s, down_after, snapshot_path, snapshot_interval, binary,
+                  resolve_retry, resolve_refresh):
+    loop = asyncio.get_running_loop()
+
+    # Names are resolved in parallel off the ping loop, so it never waits on DNS
+    async def resolve(target):
+        # Returns True when a target that had no address now has one
+        try:
+            infos = await loop.getaddrinfo(target.host, target.port,
+                                           family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        except (OSError, ValueError) as err:
+            # a target that already has an address keeps being pinged there, a DNS hiccup is not the target going down
+            if target.address is None and target.error != f"cannot resolve: {err}":
+                target.error = f"cannot resolve: {err}"
+                print(f"{timestamp()} {target.name}: {target.error}", flush=True)
+            return False
+        address = infos[0][4]
+        if target.address is not None and address != target.address:
+            print(f"{timestamp()} {target.name} moved to {address[0]}:{address[1]}", flush=True)
+        elif target.error is not None:
+            print(f"{timestamp()} {target.name} resolved to {address[0]}:{address[1]}", flush=True)
+        resolved = target.address is None
+        target.address = address
+        target.error = None
+        return resolved
+
+    async def keep_resolving():
+        # Retry the names that failed, and re-resolve the others every resolve_refresh seconds to follow address changes
+        next_refresh = time.monotonic() + resolve_refresh
+        while True:
+            await asyncio.sleep(resolve_retry)
+            refresh = time.monotonic() >= next_refresh
+            if refresh:
+                next_refresh = time.monotonic() + resolve_refresh
+            pending = [i for i, target in enumerate(targets) if refresh or target.address is None]
+            resolved = await asyncio.gather(*(resolve(targets[i]) for i in pending))
+            now = time.perf_counter_ns()
+            for i, newly_resolved in zip(pending, resolved):
+                if newly_resolved:
+                    # joins the ping schedule at once, and keeps its own slot from then on
+                    heapq.heappush(schedule, (now, i))
+
+    await asyncio.gather(*(resolve(target) for target in targets))
+    live = [i for i, target in enumerate(targets) if target.address is not None]
+
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: MonitorProtocol(binary), local_addr=("0.0.0.0", 0))
+    print(f"Monitoring {len(live)} of {len(targets)} targets every {interval} s, "
+          f"down after {down_after} misses\n", flush=True)
+
+    interval_ns = int(interval * 1e9)
+    timeout_ns = int(timeout_s * 1e9)
+    start = time.perf_counter_ns()
+    # spread the targets evenly over the interval instead of pinging them all at once
+    # entries are (due time, index into targets)
+    schedule = [(start + n * interval_ns // max(len(live), 1), i) for n, i in enumerate(live)]
+    heapq.heapify(schedule)
+    resolver = asyncio.ensure_future(keep_resolving())
+    # every ping has the same timeout, so deadlines expire in send order
+    deadlines = collections.deque()
+    sequence_number = 0
+    next_snapshot = start
+
+    try:
+        while True:
+            now = time.perf_counter_ns()
+
+            while deadlines and deadlines[0][0] <= now:
+                deadline, expired = deadlines.popleft()
+                pending = protocol.outstanding.pop(expired, None)
+                if pending is not None:
+                    pending[0].miss(down_after)
+
+            while schedule and schedule[0][0] <= now:
+                due, index = heapq.heappop(schedule)
+                target = targets[index]
+                sequence_number = (sequence_number + 1) % 2 ** 32
+                send_ns = time.perf_counter_ns()
+                if binary:
+                    transport.sendto(PingPacket.pack_ping(sequence_number, send_ns), target.address)
+                else:
+                    transport.sendto(f"Ping {sequence_number} {send_ns}".encode(), target.address)
+                target.sent += 1
+                protocol.outstanding[sequence_number] = (target, send_ns)
+                deadlines.append((send_ns + timeout_ns, sequence_number))
+                heapq.heappush(schedule, (due + interval_ns, index))
+
+            if snapshot_path and now >= next_snapshot:
+                write_snapshot(snapshot_path, targets)
+                next_snapshot = now + int(snapshot_interval * 1e9)
+
+            # sleep until the next ping, timeout or snapshot is due
+            wake = [next_snapshot] if snapshot_path else []
+            if schedule:
+                wake.append(schedule[0][0])
+            if deadlines:
+                wake.append(deadlines[0][0])
+            delay = (min(wake) - time.perf_counter_ns()) / 1e9 if wake else interval
+            await asyncio.sleep(max(delay, 0))
+    finally:
+        resolver.cancel()
+        transport.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Heartbeat monitor pinging many UDP pinger servers at once.")
+    parser.add_argument("targets", help="File with one host or host:port per line.")
+    parser.add_argument("--interval", help="Seconds between pings to the same target.", type=float, default=1.0)
+    parser.add_argument("--timeout", help="Seconds before a ping counts as lost.", type=float, default=1.0)
+    parser.add_argument("--window", help="Number of recent pings kept per target.", type=int, default=60)
+    parser.add_argument("--down-after", help="Consecutive misses before a target is DOWN.", type=int, default=3)
+    parser.add_argument("--snapshot", help="JSON file rewritten with the current state.", default="monitor.json")
+    parser.add_argument("--snapshot-interval", help="Seconds between snapshots.", type=float, default=5.0)
+    parser.add_argument("--resolve-retry", help="Seconds between attempts to resolve a name that failed.",
+                        type=float, default=30.0)
+    parser.add_argument("--resolve-refresh", help="Seconds between re-resolutions of every name.",
+                        type=float, default=300.0)
+    parser.add_argument(
+        "--format",
+        help="Ping payload, must match what the servers understand.",
+        choices=["text", "binary"],
+        default="binary",
+    )
+    args = parser.parse_args()
+
+    targets = read_targets(args.targets, args.window)
+    try:
+        asyncio.run(monitor(targets, args.interval, args.timeout, args.down_after,
+                            args.snapshot, args.snapshot_interval, args.format == "binary",
+                            args.resolve_retry, args.resolve_refresh))
+    except KeyboardInterrupt:
+        pass
+    if args.snapshot:
+        write_snapshot(args.snapshot, targets)
@@ -1,79 +1,271 @@
 from socket import *
-import time
+import argparse
+import asyncio
+import collections
 import datetime
+import math
+import time
+import PingPacket
 
 
-
-print("\n=== UDP Pinger Client ===\n")
-
 server_name = '192.168.1.86'   # ip of device running UDPPingerServer --> another laptop on same local network
-# server_name = 'iocalhost'  
+# server_name = 'iocalhost'
 server_port = 12000
 
-# Create client socket
-client_socket = socket(AF_INET, SOCK_DGRAM)
-client_socket.settimeout(1.0) # Sets timeout to be 1.0 seconds --> assumes packet was lost if not recieved in this time
-print(f"Pinging server ({server_name}:{server_port})\n")
+
+class LatencyHistogram:
+    # Streaming RTT histogram with log spaced buckets, so memory does not grow with the number of pings
+    # Each bucket covers a 1% wide range, which bounds the error of any reported percentile
+    growth = 1.01
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.jitter = 0.0
+        self.last_rtt = None
+
+    def record(self, rtt):
+        # rtt in seconds
+        self.counts[math.ceil(math.log(max(rtt, 1e-9)) / math.log(self.growth))] += 1
+        self.count += 1
+        self.total += rtt
+        self.min = min(self.min, rtt)
+        self.max = max(self.max, rtt)
+        # RFC 3550 style smoothed jitter over consecutive replies
+        if self.last_rtt is not None:
+            self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+        self.last_rtt = rtt
+
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                # clamp the bucket's upper edge to what was really observed
+                return min(max(self.growth ** index, self.min), self.max)
+        return self.max
+
+
+def print_statistics(histogram, packets_sent, packets_lost):
+    print("=== Ping Statistics ===")
+
+    if histogram.count == 0:
+        print("No responses received")
+    else:
+        print(f"Minimum RTT: {histogram.min} s")
+        print(f"Maximum RTT: {histogram.max} s")
+        print(f"Average RTT: {histogram.total / histogram.count} s")
+        for p in (50, 90, 99, 99.9):
+            print(f"p{p} RTT: {histogram.percentile(p)} s")
+        print(f"Jitter: {histogram.jitter} s\n")
+
+    pkt_loss_rate = (packets_lost / packets_sent) * 100 if packets_sent else 0.0
+
+    print(f"Packet loss rate: {pkt_loss_rate}%")
+
+
+def ping_classic(server_name, server_port, packets_sent, binary=False):
+    # Original mode: one ping per second, each waiting up to 1 second for its reply
+
+    # Create client socket
+    client_socket = socket(AF_INET, SOCK_DGRAM)
+    client_socket.settimeout(1.0) # Sets timeout to be 1.0 seconds --> assumes packet was lost if not recieved in this time
+    print(f"Pinging server ({server_name}:{server_port})\n")
+
+
+    histogram = LatencyHistogram()
+    packets_lost = 0
+
+    for sequence_number in range(1, packets_sent + 1):
+
+        # Create ping message
+        if binary:
+            ping_message = PingPacket.pack_ping(sequence_number, time.perf_counter_ns())
+        else:
+            send_time = datetime.datetime.now() # Get current time
+            ping_message = f"Ping {sequence_number} {send_time}".encode()
+
+        try:
+            # Send message to server
+            client_socket.sendto(ping_message, (server_name, server_port))
+            print(f"Sent ping #{sequence_number} to server")
+
+            # Receive response from server, skipping late replies to earlier pings until this one's second is up
+            deadline = time.monotonic() + 1.0
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise timeout
+                client_socket.settimeout(remaining)
+                response, server_address = client_socket.recvfrom(1024)
+                try:
+                    if binary:
+                        echoed_sequence_number, send_ns, flags = PingPacket.unpack_ping(response)
+                    else:
+                        echoed_sequence_number = int(response.split()[1])
+                except (IndexError, ValueError):
+                    print("Ignored a packet that is not a ping reply")
+                    continue
+                if echoed_sequence_number == sequence_number:
+                    break
+                print(f"Ignored late reply to ping #{echoed_sequence_number}")
+
+            # Calculate RTT
+            if binary:
+                # the server echoes our monotonic send timestamp back
+                rtt = (time.perf_counter_ns() - send_ns) / 1e9
+                print(f"Received response from server: ping #{echoed_sequence_number}")
+            else:
+                receive_time = datetime.datetime.now()
+                rtt = (receive_time - send_time).total_seconds()
+                print(f"Received response from server: {response.decode()}")
+            histogram.record(rtt)
+
+            print(f"RTT: {rtt} s\n")
+
+
+
+        except timeout: # Handle timeout case
+            packets_lost += 1
+            print("Request timed out\n")
+
+
+        # Wait 1 second before next ping
+        time.sleep(1)
+
 
 
-rtt_times = []
-packets_lost = 0
-packets_sent = 10
+    # Close client socket
+    client_socket.close()
+    print("Client socket closed\n")
 
-for sequence_number in range(1, packets_sent + 1):
-    
-    # Create ping message
-    send_time = datetime.datetime.now() # Get current time
-    ping_message = f"Ping {sequence_number} {send_time}"
-    
-    try:
-        # Send message to server
-        client_socket.sendto(ping_message.encode(), (server_name, server_port))
-        print(f"Sent ping #{sequence_number} to server")
-        
-        # Receive response from server
-        response, server_address = client_socket.recvfrom(1024)
-        receive_time = datetime.datetime.now()
-        
-        # Calculate RTT
-        rtt = (receive_time - send_time).total_seconds()
-        rtt_times.append(rtt)
-        
-        print(f"Received response from server: {response.decode()}")
-        print(f"RTT: {rtt} s\n")
-        
+    return histogram, packets_lost
 
 
-    except timeout: # Handle timeout case
-        packets_lost += 1
-        print("Request timed out\n")
-    
+class PingProtocol(asyncio.DatagramProtocol):
+    # Matches replies to outstanding pings by sequence number
+    def __init__(self, histogram, binary):
+        self.histogram = histogram
+        self.binary = binary
+        self.outstanding = {}   # sequence number -> send time in perf_counter_ns
+        self.late = 0           # replies that arrived after their ping timed out, or duplicates
 
-    # Wait 1 second before next ping
-    time.sleep(1)
+    def datagram_received(self, data, addr):
+        receive_ns = time.perf_counter_ns()
+        try:
+            if self.binary:
+                sequence_number, send_ns, flags = PingPacket.unpack_ping(data)
+            else:
+                sequence_number = int(data.split()[1])
+        except (IndexError, ValueError):
+            return
+        send_time = self.outstanding.pop(sequence_number, None)
+        if send_time is None:
+            self.late += 1
+            return
+        if self.binary:
+            # use the echoed timestamp, it is exactly what went on the wire
+            send_time = send_ns
+        self.histogram.record((receive_ns - send_time) / 1e9)
 
+    def error_received(self, exc):
+        # e.g. ICMP port unreachable, the ping will simply time out
+        pass
 
 
-# Close client socket
-client_socket.close()
-print("Client socket closed\n")
+async def ping_async(server_name, server_port, packets_sent, rate, window, timeout_s, binary=False):
+    # Keep up to window pings in flight, sending at rate pings per second
+    loop = asyncio.get_running_loop()
+    histogram = LatencyHistogram()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: PingProtocol(histogram, binary), remote_addr=(server_name, server_port))
+    print(f"Pinging server ({server_name}:{server_port}) at {rate} pings/s, window {window}\n")
 
+    # every ping has the same timeout, so deadlines expire in send order
+    deadlines = collections.deque()
+    packets_lost = 0
 
+    def expire(now_ns):
+        nonlocal packets_lost
+        while deadlines and deadlines[0][0] <= now_ns:
+            deadline, sequence_number = deadlines.popleft()
+            if protocol.outstanding.pop(sequence_number, None) is not None:
+                packets_lost += 1
 
-# Print statistics
-print("=== Ping Statistics ===")
+    timeout_ns = int(timeout_s * 1e9)
+    start = time.perf_counter_ns()
+    sequence_number = 0
+    while sequence_number < packets_sent:
+        now = time.perf_counter_ns()
+        expire(now)
+        # send everything that is due by now, in one burst
+        due = min(packets_sent, int((now - start) / 1e9 * rate) + 1)
+        while sequence_number < due and len(protocol.outstanding) < window:
+            sequence_number += 1
+            send_ns = time.perf_counter_ns()
+            if binary:
+                transport.sendto(PingPacket.pack_ping(sequence_number, send_ns))
+            else:
+                transport.sendto(f"Ping {sequence_number} {send_ns}".encode())
+            protocol.outstanding[sequence_number] = send_ns
+            deadlines.append((send_ns + timeout_ns, sequence_number))
+        await asyncio.sleep(0.001)
 
-min_rtt = min(rtt_times)
-max_rtt = max(rtt_times)
-avg_rtt = sum(rtt_times) / len(rtt_times)
+    # wait for the stragglers to answer or time out
+    while protocol.outstanding:
+        expire(time.perf_counter_ns())
+        await asyncio.sleep(0.001)
 
-print(f"Minimum RTT: {min_rtt} s")
-print(f"Maximum RTT: {max_rtt} s")
-print(f"Average RTT: {avg_rtt} s\n")
+    transport.close()
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    print(f"Sent {packets_sent} pings in {elapsed:.2f} s ({packets_sent / elapsed:.0f} pings/s)")
+    if protocol.late:
+        print(f"{protocol.late} replies arrived after their timeout or were duplicates")
+    print()
+    return histogram, packets_lost
 
-pkt_loss_rate = (packets_lost / packets_sent) * 100
 
-print(f"Packet loss rate: {pkt_loss_rate}%")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UDP pinger client.")
+    parser.add_argument("--server", help="Server address.", default=server_name)
+    parser.add_argument("--port", help="Port.", type=int, default=server_port)
+    parser.add_argument("--count", help="Number of pings to send.", type=int, default=10)
+    parser.add_argument(
+        "--mode",
+        help="classic sends one ping per second, async keeps many pings in flight.",
+        choices=["classic", "async"],
+        default="classic",
+    )
+    parser.add_argument("--rate", help="Pings per second in async mode.", type=float, default=1000)
+    parser.add_argument("--window", help="Most pings in flight in async mode.", type=int, default=1000)
+    parser.add_argument(
+        "--format",
+        help="text is the original readable ping, binary is a compact struct with a monotonic timestamp.",
+        choices=["text", "binary"],
+        default="text",
+    )
+    parser.add_argument("--timeout", help="Seconds before a ping counts as lost.", type=float, default=1.0)
+    args = parser.parse_args()
+    # async mode would wait for ever on a window or rate that never lets a ping go out
+    for name in ("count", "rate", "window"):
+        if getattr(args, name) <= 0:
+            parser.error(f"--{name} must be positive")
 
+    print("\n=== UDP Pinger Client ===\n")
 
+    if args.mode == "async":
+        histogram, packets_lost = asyncio.run(ping_async(
+            args.server, args.port, args.count, args.rate, args.window, args.timeout,
+            binary=args.format == "binary"))
+    else:
+        histogram, packets_lost = ping_classic(
+            args.server, args.port, args.count, binary=args.format == "binary")
 
+    # Print statistics
+    print_statistics(histogram, args.count, packets_lost)
@@ -2,22 +2,205 @@
 # We will need the following module to generate randomized lost packets
 import random
 from socket import *
+import argparse
+import math
+import os
+import signal
+import time
+import PingPacket
 
-# Create a UDP socket
-# Notice the use of SOCK_DGRAM for UDP packets
-serverSocket = socket(AF_INET, SOCK_DGRAM)
-# Assign IP address and port number to socket
-serverSocket.bind(("", 12000))
-
-while True:
-    # Generate random number in the range of 1 to 10
-    rand = random.randint(1, 10)
-    # Receive the client packet along with the address it is coming from
-    message, address = serverSocket.recvfrom(1024)
-    # Capitalize the message from the client
-    message = message.upper()
-    # If rand is less is than 4, we consider the packet lost and do not respond
-    if rand < 4:
-        continue
-    # Otherwise, the server responds
-    serverSocket.sendto(message, address)
+
+class TimerWheel:
+    # Hashed timing wheel holding delayed replies, O(1) to schedule and to expire
+    def __init__(self, tick=0.001, slots=4096):
+        self.tick = tick
+        self.slots = [[] for i in range(slots)]
+        self.current = int(time.monotonic() / tick)
+        self.pending = 0
+
+    def schedule(self, delay, item):
+        # from the real clock, self.current may lag behind after a long idle wait
+        target = max(self.current + 1, math.ceil((time.monotonic() + delay) / self.tick))
+        self.slots[target % len(self.slots)].append((target, item))
+        self.pending += 1
+
+    def next_timeout(self):
+        # Seconds until the next tick, or None if nothing is waiting
+        if not self.pending:
+            return None
+        return max(0.0, (self.current + 1) * self.tick - time.monotonic())
+
+    def advance(self, now):
+        # Return every item whose time has come, in tick order
+        now_tick = int(now / self.tick)
+        due = []
+        if self.pending:
+            # a full turn visits every slot, no need to go round again
+            steps = min(now_tick - self.current, len(self.slots))
+            for i in range(1, steps + 1):
+                index = (self.current + i) % len(self.slots)
+                slot = self.slots[index]
+                if not slot:
+                    continue
+                waiting = []
+                for target, item in slot:
+                    if target <= now_tick:
+                        due.append(item)
+                    else:
+                        waiting.append((target, item))
+                self.slots[index] = waiting
+            self.pending -= len(due)
+        self.current = max(self.current, now_tick)
+        return due
+
+
+class Impairment:
+    # Seedable model of a bad network: loss, delay and duplication of replies
+    def __init__(self, seed=None, loss=0.3, burst=None, delay=0.0, jitter=0.0, duplicate=0.0):
+        self.random = random.Random(seed)
+        self.loss = loss
+        # Gilbert-Elliott parameters (p good->bad, r bad->good, loss in bad state), None for Bernoulli loss
+        self.burst = burst
+        self.bad_state = False
+        self.delay = delay
+        self.jitter = jitter
+        self.duplicate = duplicate
+
+    def drop(self):
+        if self.burst is None:
+            return self.random.random() < self.loss
+        p, r, bad_loss = self.burst
+        # move between the good and bad state first, then lose with that state's probability
+        if self.bad_state:
+            self.bad_state = self.random.random() >= r
+        else:
+            self.bad_state = self.random.random() < p
+        return self.random.random() < (bad_loss if self.bad_state else self.loss)
+
+    def reply_delay(self):
+        if self.jitter:
+            return max(0.0, self.random.uniform(self.delay - self.jitter, self.delay + self.jitter))
+        return self.delay
+
+    def duplicated(self):
+        return self.duplicate > 0 and self.random.random() < self.duplicate
+
+
+def serve(serverSocket, impairment, report_interval, name):
+    wheel = TimerWheel()
+    received = 0
+    dropped = 0
+    last_report = time.monotonic()
+
+    while True:
+        # Wake up for the next delayed reply or the next report, whichever is first
+        wait = wheel.next_timeout()
+        if report_interval:
+            until_report = max(0.0, last_report + report_interval - time.monotonic())
+            wait = until_report if wait is None else min(wait, until_report)
+        serverSocket.settimeout(wait)
+
+        try:
+            # Receive the client packet along with the address it is coming from
+            message, address = serverSocket.recvfrom(1024)
+        except (timeout, BlockingIOError):
+            message = None
+
+        if message is not None:
+            received += 1
+            # Binary pings are echoed untouched so the client gets its timestamp back,
+            # text pings are capitalized as before
+            if not PingPacket.is_binary_ping(message):
+                message = message.upper()
+            # The impairment model decides if the packet is lost and we do not respond
+            if impairment.drop():
+                dropped += 1
+            else:
+                # Otherwise, the server responds, possibly late and possibly twice
+                copies = 2 if impairment.duplicated() else 1
+                for i in range(copies):
+                    delay = impairment.reply_delay()
+                    if delay > 0:
+                        wheel.schedule(delay, (message, address))
+                    else:
+                        serverSocket.sendto(message, address)
+
+        now = time.monotonic()
+        for reply, reply_address in wheel.advance(now):
+            serverSocket.sendto(reply, reply_address)
+
+        if report_interval and now - last_report >= report_interval:
+            elapsed = now - last_report
+            print(f"{name}: {received / elapsed:.0f} pkt/s received, {dropped / elapsed:.0f} pkt/s dropped, "
+                  f"{wheel.pending} replies delayed", flush=True)
+            received = 0
+            dropped = 0
+            last_report = now
+
+
+def make_socket(port, reuseport):
+    # Create a UDP socket
+    # Notice the use of SOCK_DGRAM for UDP packets
+    serverSocket = socket(AF_INET, SOCK_DGRAM)
+    if reuseport:
+        # every worker binds the same port, the kernel spreads clients across them
+        serverSocket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+    # Assign IP address and port number to socket
+    serverSocket.bind(("", port))
+    return serverSocket
+
+
+def run_worker(args, index):
+    # Each worker gets its own seed so the whole run is reproducible
+    seed = None if args.seed is None else args.seed + index
+    burst = None
+    if args.burst:
+        burst = tuple(args.burst)
+    impairment = Impairment(seed, args.loss, burst, args.delay, args.jitter, args.duplicate)
+    serverSocket = make_socket(args.port, args.workers > 1)
+    try:
+        serve(serverSocket, impairment, args.report_interval, f"worker {index}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        serverSocket.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UDP pinger server with a configurable impairment model.")
+    parser.add_argument("--port", help="Port.", type=int, default=12000)
+    parser.add_argument("--workers", help="Worker processes sharing the port with SO_REUSEPORT.", type=int, default=1)
+    parser.add_argument("--seed", help="Random seed, set it to repeat an experiment exactly.", type=int)
+    parser.add_argument("--loss", help="Probability a reply is dropped (the good state loss with --burst).",
+                        type=float, default=0.3)
+    parser.add_argument("--burst", help="Gilbert-Elliott burst loss: P(good->bad) P(bad->good) loss-in-bad.",
+                        type=float, nargs=3, metavar=("P", "R", "BAD_LOSS"))
+    parser.add_argument("--delay", help="Seconds each reply is held back.", type=float, default=0.0)
+    parser.add_argument("--jitter", help="Uniform +/- seconds added to --delay.", type=float, default=0.0)
+    parser.add_argument("--duplicate", help="Probability a reply is sent twice.", type=float, default=0.0)
+    parser.add_argument("--report-interval", help="Seconds between rate reports, 0 disables them.",
+                        type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        run_worker(args, 0)
+    else:
+        children = []
+        for index in range(args.workers):
+            pid = os.fork()
+            if pid == 0:
+                run_worker(args, index)
+                os._exit(0)
+            children.append(pid)
+        try:
+            for pid in children:
+                os.waitpid(pid, 0)
+        except KeyboardInterrupt:
+            # pass the interrupt on in case it was not sent to the whole process group
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGINT)
+                except ProcessLookupError:
+                    pass
+            for pid in children:
+                os.waitpid(pid, 0)
@@ -1,44 +1,789 @@
 #import socket module
 from socket import *
+import argparse
+import collections
+import errno
+import mimetypes
+import os
+import selectors
+import signal
+import time
+import traceback
+from email.utils import formatdate, parsedate_to_datetime
+from stat import S_ISREG
 
-serverSocket = socket(AF_INET, SOCK_STREAM)
-#Prepare a sever socket
-#Fill in start
 serverPort = 6789
-serverSocket.bind(('', serverPort))
-serverSocket.listen(1)
-#Fill in end
-while True:
-    #Establish the connection
-    print('Ready to serve...')
-    connectionSocket, addr = serverSocket.accept() #Fill in start #Fill in end
+# Size of each write when the kernel sendfile path is not available
+CHUNK_SIZE = 64 * 1024
+# Largest request header block we are willing to buffer for one connection
+MAX_HEADER_SIZE = 64 * 1024
+# Largest request body we buffer (and then skip), GET and HEAD have no use for one
+MAX_BODY_SIZE = 64 * 1024
+# Seconds an idle keep-alive connection is kept open
+KEEPALIVE_TIMEOUT = 15
+# Total bytes of file content kept in the in-memory response cache
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Files larger than this are never cached and always go through sendfile
+CACHE_MAX_ENTRY_BYTES = 1024 * 1024
+# Stop reading pipelined requests once this many response parts are queued
+MAX_QUEUED_PARTS = 64
+# Most byte ranges honoured in one request before falling back to the whole file
+MAX_RANGES = 16
+# Seconds a worker waits for in-flight responses when asked to shut down
+SHUTDOWN_GRACE = 10
+# errno values that mean sendfile cannot be used on this socket/file pair
+SENDFILE_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP)
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Request:
+    # A parsed request line and header block, header names are lower case
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+
+    def keep_alive(self):
+        # HTTP/1.1 is persistent unless asked otherwise, HTTP/1.0 only when asked
+        tokens = [t.strip().lower() for t in self.headers.get('connection', '').split(',')]
+        if self.version == 'HTTP/1.1':
+            return 'close' not in tokens
+        return 'keep-alive' in tokens
+
+
+class FileRegion:
+    # A slice of an open file still waiting to be written to a socket
+    def __init__(self, f, offset, count, close_file=True):
+        self.f = f
+        self.offset = offset
+        self.count = count
+        # False when later regions of the same response still read from f
+        self.close_file = close_file
+
+    def close(self):
+        if self.close_file:
+            self.f.close()
+
+
+def content_type(path):
+    # Guess the MIME type from the file extension, default to raw bytes
+    ctype, encoding = mimetypes.guess_type(path)
+    return ctype or 'application/octet-stream'
+
+
+def build_header(status, headers):
+    # Build the status line and header block as bytes, ending with the blank line
+    lines = ['HTTP/1.1 ' + status]
+    for name, value in headers:
+        lines.append(f'{name}: {value}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode()
+
+
+def connection_headers(keep_alive):
+    if keep_alive:
+        return [('Connection', 'keep-alive'), ('Keep-Alive', f'timeout={KEEPALIVE_TIMEOUT}')]
+    return [('Connection', 'close')]
+
+
+def parse_request(buf):
+    # Parse one request from the front of buf
+    # Returns (request, bytes consumed), or (None, 0) while the request is still incomplete
+    end = buf.find(b'\r\n\r\n')
+    if end < 0:
+        if len(buf) > MAX_HEADER_SIZE:
+            raise BadRequest('header block too large')
+        return None, 0
+
+    lines = bytes(buf[:end]).decode('latin-1').split('\r\n')
+    request_line = lines[0].split()
+    if len(request_line) != 3 or not request_line[2].startswith('HTTP/'):
+        raise BadRequest('malformed request line')
+    method, target, version = request_line
+
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise BadRequest('malformed header line')
+        name = name.strip().lower()
+        value = value.strip()
+        # repeated headers are folded into one comma separated value
+        headers[name] = headers[name] + ', ' + value if name in headers else value
+
+    consumed = end + 4
+    # a GET has no use for a body, but it must be skipped to find the next pipelined request
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise BadRequest('chunked request bodies are not supported')
+    length_value = headers.get('content-length', '0')
+    # int() would also take a sign, spaces or underscores, a negative length would rewind the buffer
+    if not (length_value.isascii() and length_value.isdigit()):
+        raise BadRequest('bad Content-Length')
+    body_length = int(length_value)
+    if body_length > MAX_BODY_SIZE:
+        raise BadRequest('request body too large')
+    if len(buf) < consumed + body_length:
+        return None, 0
+    consumed += body_length
+
+    return Request(method, target, version, headers), consumed
+
+
+def error_response(status, keep_alive):
+    body = f'<html><body><h1>{status}</h1></body></html>'.encode()
+    header = build_header(status, [
+        ('Content-Type', 'text/html'),
+        ('Content-Length', len(body)),
+    ] + connection_headers(keep_alive))
+    return [header + body]
+
+
+class CacheEntry:
+    # Prebuilt response for one file, valid while its mtime and size are unchanged
+    def __init__(self, st, ctype, body):
+        self.mtime_ns = st.st_mtime_ns
+        self.size = st.st_size
+        self.mtime = int(st.st_mtime)
+        self.etag, self.last_modified = file_validators(st)
+        self.ctype = ctype
+        self.body = body
+        validators = [('ETag', self.etag), ('Last-Modified', self.last_modified)]
+        # one header per Connection variant so a hit never builds a string
+        self.header = {}
+        self.not_modified = {}
+        for keep_alive in (True, False):
+            self.header[keep_alive] = build_header('200 OK', [
+                ('Content-Type', ctype),
+                ('Content-Length', self.size),
+                ('Accept-Ranges', 'bytes'),
+            ] + validators + connection_headers(keep_alive))
+            self.not_modified[keep_alive] = build_header(
+                '304 Not Modified', validators + connection_headers(keep_alive))
+
+    def matches(self, st):
+        return self.mtime_ns == st.st_mtime_ns and self.size == st.st_size
+
+
+class ResponseCache:
+    # LRU cache of prebuilt responses keyed by path, bounded by total body bytes
+    def __init__(self, max_bytes, max_entry_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.used_bytes = 0
+        self.entries = collections.OrderedDict()
+
+    def get(self, path, st):
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        if not entry.matches(st):
+            # file changed on disk since it was cached
+            self.remove(path)
+            return None
+        self.entries.move_to_end(path)
+        return entry
+
+    def cacheable(self, size):
+        return size <= self.max_entry_bytes and size <= self.max_bytes
+
+    def put(self, path, entry):
+        if not self.cacheable(entry.size):
+            return
+        self.remove(path)
+        self.entries[path] = entry
+        self.used_bytes += entry.size
+        while self.used_bytes > self.max_bytes:
+            old_path, old_entry = self.entries.popitem(last=False)
+            self.used_bytes -= old_entry.size
+
+    def remove(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.used_bytes -= entry.size
+
+
+response_cache = ResponseCache(CACHE_MAX_BYTES, CACHE_MAX_ENTRY_BYTES)
+# Set by SIGTERM/SIGINT, the serve loops check it and wind down
+stopping = False
+
+
+def file_validators(st):
+    # ETag and Last-Modified values derived from the file metadata
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    return etag, formatdate(st.st_mtime, usegmt=True)
+
+
+def not_modified(request, etag, mtime):
+    # True when the client's conditional headers show its copy is current
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        # weak comparison, a W/ prefix does not matter for GET
+        tags = [t.strip().removeprefix('W/') for t in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return mtime <= since
+    return False
+
+
+def parse_range(value, size):
+    # Parse a "bytes=..." Range header into (start, end) pairs, end inclusive
+    # Returns None when the header should be ignored and [] when nothing is satisfiable
+    unit, sep, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or not sep:
+        return None
+    ranges = []
+    for item in spec.split(','):
+        first, dash, last = item.strip().partition('-')
+        if not dash:
+            return None
+        try:
+            if first == '':
+                # suffix range, the last N bytes of the file
+                start = max(size - int(last), 0)
+                end = size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start <= end:
+            ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        # too many pieces to be worth it, send the whole file instead
+        return None
+    return ranges
+
+
+def requested_ranges(request, size, etag, last_modified):
+    # Byte ranges a GET asks for, None to send the whole file
+    value = request.headers.get('range')
+    if value is None or request.method != 'GET':
+        return None
+    if_range = request.headers.get('if-range')
+    if if_range is not None and if_range not in (etag, last_modified):
+        # the client's partial copy is out of date, it needs the whole new file
+        return None
+    return parse_range(value, size)
+
+
+def range_response(ranges, size, ctype, validators, keep_alive, body=None, f=None):
+    # 206 response for the given ranges, sliced from a cached body or an open file
+    def piece(start, end, last):
+        if body is not None:
+            return memoryview(body)[start:end + 1]
+        # the file stays open until the last region that uses it is written
+        return FileRegion(f, start, end - start + 1, close_file=last)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        header = build_header('206 Partial Content', [
+            ('Content-Type', ctype),
+            ('Content-Range', f'bytes {start}-{end}/{size}'),
+            ('Content-Length', end - start + 1),
+        ] + validators + connection_headers(keep_alive))
+        return [header, piece(start, end, True)]
+
+    boundary = os.urandom(12).hex()
+    parts = []
+    length = 0
+    for i, (start, end) in enumerate(ranges):
+        part_header = (
+            f'\r\n--{boundary}\r\nContent-Type: {ctype}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode()
+        parts += [part_header, piece(start, end, i == len(ranges) - 1)]
+        length += len(part_header) + end - start + 1
+    trailer = f'\r\n--{boundary}--\r\n'.encode()
+    parts.append(trailer)
+    length += len(trailer)
+    header = build_header('206 Partial Content', [
+        ('Content-Type', f'multipart/byteranges; boundary={boundary}'),
+        ('Content-Length', length),
+    ] + validators + connection_headers(keep_alive))
+    return [header] + parts
+
+
+def not_satisfiable(size, keep_alive):
+    return [build_header('416 Range Not Satisfiable', [
+        ('Content-Range', f'bytes */{size}'),
+        ('Content-Length', 0),
+    ] + connection_headers(keep_alive))]
+
+
+def make_response(request, keep_alive):
+    # Turn a parsed request into a list of response parts: bytes and FileRegions
+    if request.method not in ('GET', 'HEAD'):
+        return error_response('501 Not Implemented', keep_alive)
+
+    filename = request.target.split('?', 1)[0]
+    path = filename[1:]
     try:
-        message =  connectionSocket.recv(1024).decode() #Fill in start #Fill in end
-        filename = message.split()[1]
-        f = open(filename[1:])
-
-        outputdata = f.read()# Fill in start # Fill in end
-
-        #Send one HTTP header line into socket
-        #Fill in start
-        header_ok = 'HTTP/1.1 200 OK\r\n'
-        connectionSocket.send(header_ok.encode())
-        #Fill in end
-        #Send the content of the requested file to the client
-        for i in range(0, len(outputdata)):
-            connectionSocket.send(outputdata[i].encode())
-        connectionSocket.send("\r\n".encode())
-        connectionSocket.close()
-    except IOError:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    if st is None or not S_ISREG(st.st_mode):
         #Send response message for file not found
-        # Fill in start
-        header_error = 'HTTP/1.1 404 Not Found\r\n'
-        connectionSocket.send(header_error.encode())
-        # Fill in end
+        return error_response('404 Not Found', keep_alive)
+
+    # Hot files are answered from memory without opening them
+    entry = response_cache.get(path, st)
+    if entry is None and response_cache.cacheable(st.st_size):
+        try:
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                body = f.read()
+        except IOError:
+            return error_response('404 Not Found', keep_alive)
+        # only keep it if the file did not change while we read it
+        if len(body) == st.st_size:
+            entry = CacheEntry(st, content_type(filename), body)
+            response_cache.put(path, entry)
+    if entry is not None:
+        if not_modified(request, entry.etag, entry.mtime):
+            return [entry.not_modified[keep_alive]]
+        ranges = requested_ranges(request, entry.size, entry.etag, entry.last_modified)
+        if ranges == []:
+            return not_satisfiable(entry.size, keep_alive)
+        if ranges:
+            validators = [('ETag', entry.etag), ('Last-Modified', entry.last_modified)]
+            return range_response(ranges, entry.size, entry.ctype, validators, keep_alive, body=entry.body)
+        if request.method == 'HEAD':
+            return [entry.header[keep_alive]]
+        return [entry.header[keep_alive], entry.body]
+
+    # Large (or changing) files are streamed from disk with sendfile
+    try:
+        # Open in binary mode so any file type is sent byte for byte
+        f = open(path, 'rb')
+        st = os.fstat(f.fileno())
+    except IOError:
+        return error_response('404 Not Found', keep_alive)
+
+    etag, last_modified = file_validators(st)
+    validators = [('ETag', etag), ('Last-Modified', last_modified)]
+    if not_modified(request, etag, int(st.st_mtime)):
+        f.close()
+        return [build_header('304 Not Modified', validators + connection_headers(keep_alive))]
+
+    ranges = requested_ranges(request, st.st_size, etag, last_modified)
+    if ranges == []:
+        f.close()
+        return not_satisfiable(st.st_size, keep_alive)
+    if ranges:
+        return range_response(ranges, st.st_size, content_type(filename), validators, keep_alive, f=f)
+
+    header_ok = build_header('200 OK', [
+        ('Content-Type', content_type(filename)),
+        ('Content-Length', st.st_size),
+        ('Accept-Ranges', 'bytes'),
+    ] + validators + connection_headers(keep_alive))
+    if request.method == 'HEAD':
+        f.close()
+        return [header_ok]
+    return [header_ok, FileRegion(f, 0, st.st_size)]
+
+
+def send_file(connectionSocket, f, offset, count):
+    # Stream count bytes of the file starting at offset into the socket
+    # Uses os.sendfile so the data never passes through Python, otherwise large buffered writes
+    sent = 0
+    if hasattr(os, 'sendfile'):
+        try:
+            while sent < count:
+                n = os.sendfile(connectionSocket.fileno(), f.fileno(), offset + sent, count - sent)
+                if n == 0:
+                    # file was truncated while we were sending it
+                    return sent
+                sent += n
+            return sent
+        except OSError as err:
+            # only fall back if the kernel refused before anything went out
+            if sent or err.errno not in SENDFILE_UNSUPPORTED:
+                raise
+
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    f.seek(offset)
+    while sent < count:
+        n = f.readinto(view[:min(CHUNK_SIZE, count - sent)])
+        if not n:
+            break
+        connectionSocket.sendall(view[:n])
+        sent += n
+    return sent
+
+
+def send_region_nonblocking(sock, region):
+    # Write as much of region as the socket accepts right now, return bytes written
+    # Raises BlockingIOError when the socket buffer is already full
+    if hasattr(os, 'sendfile'):
+        try:
+            return os.sendfile(sock.fileno(), region.f.fileno(), region.offset, region.count)
+        except OSError as err:
+            if err.errno not in SENDFILE_UNSUPPORTED:
+                raise
+    chunk = os.pread(region.f.fileno(), min(CHUNK_SIZE, region.count), region.offset)
+    if not chunk:
+        return 0
+    return sock.send(chunk)
+
+
+class Connection:
+    # Per-client state for the event loop: unparsed input and queued output
+    def __init__(self, sock, selector):
+        self.sock = sock
+        self.selector = selector
+        self.inbuf = bytearray()
+        self.outq = collections.deque()
+        self.close_after_write = False
+        self.last_active = time.monotonic()
+
+    def on_readable(self):
+        try:
+            data = self.sock.recv(CHUNK_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.close()
+            return
+        if not data:
+            # client went away, drop anything still queued
+            self.close()
+            return
+        self.last_active = time.monotonic()
+        self.inbuf += data
+        self.process_requests()
+        self.on_writable()
+
+    def process_requests(self):
+        # Answer every complete request in the buffer, in order, so pipelining works
+        while not self.close_after_write and len(self.outq) < MAX_QUEUED_PARTS:
+            try:
+                request, consumed = parse_request(self.inbuf)
+            except BadRequest:
+                self.outq.extend(error_response('400 Bad Request', False))
+                self.close_after_write = True
+                break
+            if request is None:
+                break
+            del self.inbuf[:consumed]
+            keep_alive = request.keep_alive()
+            self.outq.extend(make_response(request, keep_alive))
+            if not keep_alive:
+                self.close_after_write = True
+
+    def update_interest(self):
+        # Pause reading while too much output is queued or the connection is closing
+        events = 0
+        if not self.close_after_write and len(self.outq) < MAX_QUEUED_PARTS:
+            events |= selectors.EVENT_READ
+        if self.outq:
+            events |= selectors.EVENT_WRITE
+        self.selector.modify(self.sock, events, self)
+
+    def flush(self):
+        # Write queued parts until the queue is empty or the socket would block
+        while self.outq:
+            part = self.outq[0]
+            if isinstance(part, FileRegion):
+                n = send_region_nonblocking(self.sock, part)
+                part.offset += n
+                part.count -= n
+                if n == 0 or part.count == 0:
+                    part.close()
+                    self.outq.popleft()
+            else:
+                n = self.sock.send(part)
+                if n < len(part):
+                    # memoryview so a partial write does not copy the rest
+                    self.outq[0] = memoryview(part)[n:]
+                else:
+                    self.outq.popleft()
+            self.last_active = time.monotonic()
+
+    def on_writable(self):
+        while True:
+            try:
+                self.flush()
+            except BlockingIOError:
+                self.update_interest()
+                return
+            except OSError:
+                self.close()
+                return
+
+            if self.close_after_write:
+                self.close()
+                return
+            # room in the queue again, pick up any pipelined requests we held back
+            if not self.inbuf:
+                break
+            self.process_requests()
+            if not self.outq:
+                break
+        self.update_interest()
+
+    def close(self):
+        if self.sock is None:
+            return
+        for part in self.outq:
+            if isinstance(part, FileRegion):
+                part.close()
+        self.outq.clear()
+        self.selector.unregister(self.sock)
+        self.sock.close()
+        self.sock = None
+
+
+def close_idle(selector, max_idle=KEEPALIVE_TIMEOUT):
+    # Drop keep-alive connections that have been quiet for too long
+    now = time.monotonic()
+    for key in list(selector.get_map().values()):
+        conn = key.data
+        if conn is not None and not conn.outq and now - conn.last_active > max_idle:
+            conn.close()
+
+
+def request_shutdown(signum, frame):
+    # Signal handler: finish the responses in flight, then exit
+    global stopping
+    stopping = True
+
+
+def serve_event_loop(serverSocket):
+    # Multiplex every client in one thread with selectors (epoll on Linux)
+    serverSocket.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(serverSocket, selectors.EVENT_READ, None)
+    print('Ready to serve (event loop)...')
+    last_sweep = time.monotonic()
+    shutdown_deadline = None
+    while True:
+        if stopping and shutdown_deadline is None:
+            # stop accepting and let the open connections drain
+            selector.unregister(serverSocket)
+            shutdown_deadline = time.monotonic() + SHUTDOWN_GRACE
+            for key in list(selector.get_map().values()):
+                key.data.close_after_write = True
+            close_idle(selector, max_idle=0)
+        if shutdown_deadline is not None:
+            if not selector.get_map() or time.monotonic() > shutdown_deadline:
+                break
+
+        for key, events in selector.select(timeout=1):
+            if key.data is None:
+                # drain the accept queue, new clients may have piled up
+                while True:
+                    try:
+                        connectionSocket, addr = serverSocket.accept()
+                    except BlockingIOError:
+                        break
+                    connectionSocket.setblocking(False)
+                    connectionSocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+                    conn = Connection(connectionSocket, selector)
+                    selector.register(connectionSocket, selectors.EVENT_READ, conn)
+                continue
+
+            conn = key.data
+            if events & selectors.EVENT_READ and conn.sock is not None:
+                conn.on_readable()
+            if events & selectors.EVENT_WRITE and conn.sock is not None:
+                conn.on_writable()
+
+        if time.monotonic() - last_sweep >= 1:
+            close_idle(selector)
+            last_sweep = time.monotonic()
+
+    for key in list(selector.get_map().values()):
+        key.data.close()
+    selector.close()
+
+
+def write_parts(connectionSocket, parts):
+    # Blocking write of a whole response, closing any files as they finish
+    try:
+        for part in parts:
+            if isinstance(part, FileRegion):
+                send_file(connectionSocket, part.f, part.offset, part.count)
+            else:
+                connectionSocket.sendall(part)
+    finally:
+        for part in parts:
+            if isinstance(part, FileRegion):
+                part.close()
+
+
+def serve_blocking(serverSocket):
+    # One client at a time, but each client may send many (pipelined) requests
+    # accept wakes up every second so a shutdown request is noticed
+    serverSocket.settimeout(1)
+    while not stopping:
+        #Establish the connection
+        print('Ready to serve...')
+        try:
+            connectionSocket, addr = serverSocket.accept() #Fill in start #Fill in end
+        except timeout:
+            continue
+        connectionSocket.settimeout(KEEPALIVE_TIMEOUT)
+        buf = bytearray()
+        try:
+            keep_alive = True
+            while keep_alive and not stopping:
+                try:
+                    request, consumed = parse_request(buf)
+                except BadRequest:
+                    write_parts(connectionSocket, error_response('400 Bad Request', False))
+                    break
+                if request is None:
+                    data = connectionSocket.recv(CHUNK_SIZE) #Fill in start #Fill in end
+                    if not data:
+                        break
+                    buf += data
+                    continue
+                del buf[:consumed]
+                # only one client is served at a time, so stay open just for requests already pipelined
+                # an idle persistent connection would hold every other client up for KEEPALIVE_TIMEOUT
+                keep_alive = request.keep_alive() and len(buf) > 0
+                #Send the header and the content of the requested file to the client
+                write_parts(connectionSocket, make_response(request, keep_alive))
+        except (timeout, OSError):
+            # idle timeout or the client reset the connection
+            pass
+        finally:
+            #Close client socket
+            # Fill in start
+            connectionSocket.close()
+            # Fill in end
+
+
+def make_server_socket(port, backlog, reuseport):
+    serverSocket = socket(AF_INET, SOCK_STREAM)
+    #Prepare a sever socket
+    #Fill in start
+    serverSocket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    if reuseport:
+        # every worker gets its own accept queue, the kernel balances between them
+        serverSocket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+    serverSocket.bind(('', port))
+    serverSocket.listen(backlog)
+    #Fill in end
+    return serverSocket
+
+
+def run_worker(args, serverSocket):
+    # Body of one server process, returns once a shutdown has been requested
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+    if serverSocket is None:
+        serverSocket = make_server_socket(args.port, SOMAXCONN, True)
+    try:
+        if args.mode == 'event':
+            serve_event_loop(serverSocket)
+        else:
+            serve_blocking(serverSocket)
+    finally:
+        serverSocket.close()
+
+
+def supervise(args, serverSocket):
+    # Pre-fork args.workers processes and restart any that die until told to stop
+    workers = {}
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(args, serverSocket)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        workers[pid] = time.monotonic()
+        print(f'Started worker {pid}')
+
+    def forward_shutdown(signum, frame):
+        request_shutdown(signum, frame)
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward_shutdown)
+    signal.signal(signal.SIGINT, forward_shutdown)
+    for i in range(args.workers):
+        spawn()
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        print(f'Worker {pid} exited with status {status}, restarting')
+        # do not spin if a worker dies straight away, e.g. on a bad config
+        if time.monotonic() - started < 1:
+            time.sleep(1)
+        spawn()
+
+    if serverSocket is not None:
+        serverSocket.close()
+
 
-        #Close client socket
-        # Fill in start
-        connectionSocket.close()
-        # Fill in end
-serverSocket.close()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simple HTTP web server.')
+    parser.add_argument('--port', help='Port.', type=int, default=serverPort)
+    parser.add_argument(
+        '--mode',
+        help='blocking serves one client at a time, event multiplexes all clients in one thread.',
+        choices=['blocking', 'event'],
+        default='blocking',
+    )
+    parser.add_argument(
+        '--cache-bytes',
+        help='Memory budget of the response cache in bytes, 0 disables it.',
+        type=int,
+        default=CACHE_MAX_BYTES,
+    )
+    parser.add_argument(
+        '--workers',
+        help='Number of pre-forked server processes, 1 runs in this process.',
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        '--reuseport',
+        help='Give each worker its own listening socket with SO_REUSEPORT instead of sharing one.',
+        action='store_true',
+    )
+    args = parser.parse_args()
+    if args.workers > 1 and not hasattr(os, 'fork'):
+        parser.error('--workers needs os.fork, which this platform does not have')
+    if args.reuseport and 'SO_REUSEPORT' not in globals():
+        parser.error('--reuseport is not supported on this platform')
+    response_cache.max_bytes = args.cache_bytes
 
+    if args.workers > 1:
+        serverSocket = None
+        if not args.reuseport:
+            # bound once here and inherited by every worker
+            serverSocket = make_server_socket(args.port, SOMAXCONN, False)
+        supervise(args, serverSocket)
+    else:
+        backlog = 1 if args.mode == 'blocking' else SOMAXCONN
+        run_worker(args, make_server_socket(args.port, backlog, args.reuseport))
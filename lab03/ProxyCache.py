@@ -0,0 +1,388 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+# Freshness lifetime used when the origin gives no Cache-Control max-age, Expires or Last-Modified
+DEFAULT_TTL = 3600
+# Upper bound for the Last-Modified based heuristic lifetime
+MAX_HEURISTIC_TTL = 24 * 3600
+# Objects are spread over 256 * 256 directories named after the first bytes of the key's hash
+SHARD_LEVELS = 2
+# Sidecar next to every object holding its index record, used to rebuild a lost journal
+META_SUFFIX = '.meta'
+# Counters per row of the access frequency sketch of the memory tier
+SKETCH_WIDTH = 4096
+# Rewrite the journal once it holds this many times more records than there are entries
+JOURNAL_COMPACT_RATIO = 4
+
+
+class CacheEntry:
+    # Index record for one cached object
+    def __init__(self, key, size, last_access, expires, content_type, etag=None, last_modified=None):
+        self.key = key
+        self.size = size
+        self.last_access = last_access
+        self.expires = expires
+        self.content_type = content_type
+        # validators sent back to the origin to revalidate a stale copy
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def fresh(self, now=None):
+        return (now or time.time()) < self.expires
+
+    def to_record(self):
+        return '\t'.join(['P', self.key, str(self.size), f'{self.last_access:.0f}',
+                          f'{self.expires:.0f}', self.content_type or '',
+                          self.etag or '', self.last_modified or ''])
+
+    @classmethod
+    def from_record(cls, fields):
+        key, size, last_access, expires, content_type = fields[:5]
+        # records written before validators were kept have no etag/last-modified fields
+        etag, last_modified = (fields[5:7] + ['', ''])[:2]
+        return cls(key, int(size), float(last_access), float(expires), content_type or None,
+                   etag or None, last_modified or None)
+
+    def conditional_headers(self):
+        # Request headers asking the origin to answer 304 if our copy is still current
+        headers = ''
+        if self.etag:
+            headers += f'If-None-Match: {self.etag}\r\n'
+        if self.last_modified:
+            headers += f'If-Modified-Since: {self.last_modified}\r\n'
+        return headers
+
+
+def normalize_url(url):
+    # Cache key for a proxied "host[:port]/path" url, equivalent spellings of it share one object
+    host, _, path = url.partition('/')
+    host = host.lower()
+    if host.endswith(':80'):
+        host = host[:-3]
+    if host.startswith('www.'):
+        host = host[4:]
+    # the fragment never reaches the origin
+    return host + '/' + path.partition('#')[0]
+
+
+def parse_cache_control(value):
+    # "no-store, max-age=60" -> {'no-store': None, 'max-age': '60'}
+    directives = {}
+    for item in (value or '').split(','):
+        name, sep, arg = item.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') if sep else None
+    return directives
+
+
+def freshness(headers, now=None):
+    # Decide from the response headers whether an object may be stored and until when it is fresh
+    # headers maps lower case names to values, returns (cacheable, expires)
+    now = now or time.time()
+    directives = parse_cache_control(headers.get('cache-control'))
+    if 'no-store' in directives or 'private' in directives:
+        return False, now
+    age = int(headers['age']) if headers.get('age', '').isdigit() else 0
+
+    if 'no-cache' in directives:
+        # may be stored, but every use must go back to the origin first
+        return True, now
+    for name in ('s-maxage', 'max-age'):
+        if name in directives:
+            try:
+                return True, now + int(directives[name]) - age
+            except (TypeError, ValueError):
+                return True, now
+    if 'expires' in headers:
+        try:
+            return True, parsedate_to_datetime(headers['expires']).timestamp()
+        except (TypeError, ValueError):
+            # an invalid Expires means already expired
+            return True, now
+    if 'last-modified' in headers:
+        # heuristic from RFC 9111: a tenth of the time since the object last changed
+        try:
+            modified = parsedate_to_datetime(headers['last-modified']).timestamp()
+            return True, now + min(max(now - modified, 0) / 10, MAX_HEURISTIC_TTL)
+        except (TypeError, ValueError):
+            pass
+    return True, now + DEFAULT_TTL
+
+
+class CacheManager:
+    # In-memory index of the objects on disk, bounded by a byte budget with LRU eviction
+    # The index survives restarts through an append-only journal of put/delete records
+    def __init__(self, root, max_bytes, journal_name='.cache-journal'):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.journal_path = os.path.join(root, journal_name)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> CacheEntry, least recently used first
+        self.used_bytes = 0
+        self.journal_records = 0
+        os.makedirs(root, exist_ok=True)
+        self._load_journal()
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+        if self.journal_records < len(self.entries):
+            # the index was rebuilt from the sidecars, write it all to the new journal
+            self._compact()
+        self._evict()
+
+    def path_for(self, key):
+        # Fixed-length name from the hash of the key, so any url maps to a valid file and never to a directory
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        shards = [digest[2 * i:2 * i + 2] for i in range(SHARD_LEVELS)]
+        return os.path.join(self.root, *shards, digest)
+
+    def lookup(self, key):
+        # Entry for key, fresh or stale, or None when the object is not cached
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            entry.last_access = time.time()
+            self.entries.move_to_end(key)
+            return entry
+
+    def store(self, key, size, expires, content_type, etag=None, last_modified=None):
+        # Record an object whose file was just renamed into place at path_for(key)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.used_bytes -= old.size
+            if size > self.max_bytes:
+                self._delete_file(key)
+                self._append('D\t' + key)
+                return None
+            entry = CacheEntry(key, size, time.time(), expires, content_type, etag, last_modified)
+            self.entries[key] = entry
+            self.used_bytes += size
+            self._write_meta(entry)
+            self._append(entry.to_record())
+            self._evict()
+            return entry
+
+    def refresh(self, key, expires):
+        # The origin confirmed our copy with a 304, extend its lifetime
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry.expires = expires
+                entry.last_access = time.time()
+                self._write_meta(entry)
+                self._append(entry.to_record())
+            return entry
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.used_bytes -= entry.size
+                self._delete_file(key)
+                self._append('D\t' + key)
+
+    def close(self):
+        # Leave a compact journal behind, including the latest access times
+        with self.lock:
+            self._compact()
+            self.journal.close()
+
+    def _evict(self):
+        # caller holds the lock
+        while self.used_bytes > self.max_bytes and self.entries:
+            key, entry = self.entries.popitem(last=False)
+            self.used_bytes -= entry.size
+            self._delete_file(key)
+            self._append('D\t' + key)
+
+    def _delete_file(self, key):
+        # readers that already opened the file keep streaming it
+        path = self.path_for(key)
+        for name in (path, path + META_SUFFIX):
+            try:
+                os.unlink(name)
+            except FileNotFoundError:
+                pass
+
+    def _write_meta(self, entry):
+        # caller holds the lock, the sidecar is replaced atomically like the object itself
+        path = self.path_for(entry.key) + META_SUFFIX
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(entry.to_record() + '\n')
+        os.replace(path + '.tmp', path)
+
+    def _append(self, record):
+        self.journal.write(record + '\n')
+        self.journal.flush()
+        self.journal_records += 1
+        if self.journal_records > JOURNAL_COMPACT_RATIO * max(len(self.entries), 64):
+            self._compact()
+
+    def _compact(self):
+        # Rewrite the journal with one record per live entry, replacing it atomically
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self.entries.values():
+                f.write(entry.to_record() + '\n')
+        os.replace(tmp_path, self.journal_path)
+        if not self.journal.closed:
+            self.journal.close()
+            self.journal = open(self.journal_path, 'a', encoding='utf-8')
+        self.journal_records = len(self.entries)
+
+    def _load_journal(self):
+        try:
+            f = open(self.journal_path, encoding='utf-8')
+        except FileNotFoundError:
+            self._scan_sidecars()
+        else:
+            with f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    try:
+                        if fields[0] == 'P':
+                            entry = CacheEntry.from_record(fields[1:])
+                            self.entries.pop(entry.key, None)
+                            self.entries[entry.key] = entry
+                        elif fields[0] == 'D':
+                            self.entries.pop(fields[1], None)
+                    except (IndexError, ValueError):
+                        # a torn last line from a crash, ignore it
+                        continue
+                    self.journal_records += 1
+
+        # restore LRU order and drop entries whose file disappeared
+        for entry in sorted(self.entries.values(), key=lambda e: e.last_access):
+            self.entries.move_to_end(entry.key)
+        for key in list(self.entries):
+            if not os.path.isfile(self.path_for(key)):
+                del self.entries[key]
+        self.used_bytes = sum(entry.size for entry in self.entries.values())
+
+    def _scan_sidecars(self):
+        # Rebuild the index from the sidecars when there is no journal, only walks the shard directories
+        for directory, subdirs, files in os.walk(self.root):
+            depth = len(os.path.relpath(directory, self.root).split(os.sep))
+            if directory == self.root or depth < SHARD_LEVELS:
+                subdirs[:] = [d for d in subdirs if len(d) == 2]
+                continue
+            subdirs[:] = []
+            for name in files:
+                if not name.endswith(META_SUFFIX):
+                    continue
+                try:
+                    with open(os.path.join(directory, name), encoding='utf-8') as f:
+                        fields = f.readline().rstrip('\n').split('\t')
+                    entry = CacheEntry.from_record(fields[1:])
+                except (OSError, IndexError, ValueError):
+                    continue
+                if os.path.join(directory, name) == self.path_for(entry.key) + META_SUFFIX:
+                    self.entries[entry.key] = entry
+
+
+class FrequencySketch:
+    # Approximate access counts (count-min sketch of 4-bit counters) for TinyLFU admission
+    # Counters are halved every 10 * width accesses so old popularity fades
+    def __init__(self, width=SKETCH_WIDTH, depth=4):
+        self.width = width
+        self.rows = [bytearray(width) for _ in range(depth)]
+        self.additions = 0
+        self.sample_size = 10 * width
+
+    def _slots(self, key):
+        return [hash((i, key)) % self.width for i in range(len(self.rows))]
+
+    def add(self, key):
+        for row, slot in zip(self.rows, self._slots(key)):
+            if row[slot] < 15:
+                row[slot] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            for row in self.rows:
+                for slot in range(self.width):
+                    row[slot] >>= 1
+            self.additions //= 2
+
+    def estimate(self, key):
+        return min(row[slot] for row, slot in zip(self.rows, self._slots(key)))
+
+
+class MemoryObject:
+    # A cached object held in memory, ready to send: the header block and the body
+    def __init__(self, entry, header, body):
+        self.entry = entry      # disk tier CacheEntry this copy was made from
+        self.header = header
+        self.body = body
+        self.size = len(header) + len(body)
+
+
+class MemoryCache:
+    # Small, popular objects kept in RAM in front of the disk cache, bounded by a byte budget
+    # LRU order within the tier, and TinyLFU admission: an object only displaces objects accessed less often
+    def __init__(self, max_bytes, max_object_bytes):
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self.lock = threading.Lock()
+        self.objects = OrderedDict()   # key -> MemoryObject, least recently used first
+        self.used_bytes = 0
+        self.sketch = FrequencySketch()
+
+    def get(self, key, entry):
+        # Counts the access and returns the in-memory copy of entry, or None
+        with self.lock:
+            self.sketch.add(key)
+            obj = self.objects.get(key)
+            if obj is None:
+                return None
+            if obj.entry is not entry:
+                # the disk tier holds a newer version
+                self._drop(key)
+                return None
+            self.objects.move_to_end(key)
+            return obj
+
+    def wants(self, key, size):
+        # Whether an object of this size would be admitted, checked before reading it from disk
+        with self.lock:
+            return self._victims(key, size) is not None
+
+    def put(self, key, entry, header, body):
+        obj = MemoryObject(entry, header, body)
+        with self.lock:
+            victims = self._victims(key, obj.size)
+            if victims is None:
+                return False
+            for victim in victims:
+                self._drop(victim)
+            self._drop(key)
+            self.objects[key] = obj
+            self.used_bytes += obj.size
+            return True
+
+    def _victims(self, key, size):
+        # caller holds the lock, the least recently used keys to evict for this object or None to reject it
+        if self.max_bytes <= 0 or size > min(self.max_object_bytes, self.max_bytes):
+            return None
+        frequency = self.sketch.estimate(key)
+        victims = []
+        free = self.max_bytes - self.used_bytes
+        for victim, obj in self.objects.items():
+            if free >= size:
+                break
+            if victim == key:
+                free += obj.size
+                continue
+            if self.sketch.estimate(victim) >= frequency:
+                return None
+            victims.append(victim)
+            free += obj.size
+        return victims if free >= size else None
+
+    def _drop(self, key):
+        obj = self.objects.pop(key, None)
+        if obj is not None:
+            self.used_bytes -= obj.size
@@ -0,0 +1,96 @@
+import collections
+import math
+import threading
+import time
+
+
+class LatencyHistogram:
+    # Counts latencies rounded to three significant digits: the stats page stays within 0.5%
+    # and the number of distinct values stays small however many requests are served
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[float(f'{seconds:.3g}')] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def summary(self):
+        # Milliseconds, for the stats endpoint
+        if self.count == 0:
+            return {'count': 0}
+        summary = {'count': self.count,
+                   'min_ms': self.min * 1000,
+                   'mean_ms': self.total / self.count * 1000,
+                   'max_ms': self.max * 1000}
+        # one walk over the sorted values finds every percentile
+        ranks = {p: math.ceil(self.count * p / 100) for p in (50, 90, 99)}
+        seen = 0
+        for value in sorted(self.counts):
+            seen += self.counts[value]
+            for p in [p for p, rank in ranks.items() if seen >= rank]:
+                summary[f'p{p}_ms'] = value * 1000
+                del ranks[p]
+        return summary
+
+
+class ProxyStats:
+    # Counters and latency histograms shared by every worker thread
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = collections.Counter()
+        self.active_connections = 0
+        self.origin_latency = LatencyHistogram()   # request sent to origin until its response head arrived
+        self.ttfb = LatencyHistogram()             # client request received until the proxy starts answering
+        self.request = threading.local()
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def connection_opened(self):
+        with self.lock:
+            self.active_connections += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.active_connections -= 1
+
+    def origin_fetched(self, seconds):
+        with self.lock:
+            self.origin_latency.record(seconds)
+
+    def begin_request(self):
+        # Start the time to first byte clock of the request this thread is serving
+        self.request.started = time.perf_counter()
+
+    def first_byte(self):
+        # The response is about to be sent, only the first call per request is recorded
+        started = getattr(self.request, 'started', None)
+        if started is None:
+            return
+        self.request.started = None
+        with self.lock:
+            self.ttfb.record(time.perf_counter() - started)
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            hits = sum(counters.get(f'hits_{kind}', 0) for kind in ('memory', 'disk', 'coalesced', 'revalidated'))
+            lookups = hits + counters.get('misses', 0)
+            cache_bytes = sum(counters.get(f'bytes_from_{tier}', 0) for tier in ('memory', 'disk', 'coalesced'))
+            served_bytes = cache_bytes + counters.get('bytes_from_origin', 0)
+            return {'uptime_s': time.time() - self.started,
+                    'active_connections': self.active_connections,
+                    'counters': counters,
+                    'hit_ratio': hits / lookups if lookups else None,
+                    'byte_hit_ratio': cache_bytes / served_bytes if served_bytes else None,
+                    'origin_latency': self.origin_latency.summary(),
+                    'ttfb': self.ttfb.summary()}
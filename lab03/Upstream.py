@@ -0,0 +1,270 @@
+import select
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from socket import *
+
+# Size of the reusable buffer each response is received into
+BUFFER_SIZE = 64 * 1024
+# Seconds a resolved origin address is reused, getaddrinfo does not report the record's own TTL
+DNS_TTL = 60
+# Seconds a failed resolution is remembered, so a bad hostname does not hit the resolver on every request
+DNS_NEGATIVE_TTL = 10
+# An address used in the last tenth of its lifetime is resolved again in the background
+DNS_PREFETCH_FRACTION = 0.1
+# Threads running getaddrinfo
+RESOLVER_THREADS = 4
+# Resolved names kept before expired ones are pruned
+DNS_MAX_ENTRIES = 4096
+
+
+class ConnectionClosed(Exception):
+    # The origin closed or broke the connection in the middle of a response
+    pass
+
+
+class ResponseReader:
+    # Reads one HTTP/1.1 response from an origin connection through a single reusable buffer
+    # Body data is handed out as memoryviews into that buffer, valid until the next one is requested
+    def __init__(self, sock, size=BUFFER_SIZE):
+        self.sock = sock
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0          # first unread byte in buf
+        self.end = 0            # one past the last received byte
+        self.reusable = False   # True once a whole, well-framed response has been read
+
+    def _fill(self):
+        # Receive more data after the unread bytes, returns the number of bytes received
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buf):
+            if self.start == 0:
+                raise ValueError('header line longer than the receive buffer')
+            # slide the unread tail to the front, it is never more than one partial line
+            unread = self.end - self.start
+            self.buf[:unread] = self.buf[self.start:self.end]
+            self.start, self.end = 0, unread
+        n = self.sock.recv_into(self.view[self.end:])
+        self.end += n
+        return n
+
+    def read_line(self):
+        while True:
+            i = self.buf.find(b'\r\n', self.start, self.end)
+            if i >= 0:
+                line = bytes(self.buf[self.start:i])
+                self.start = i + 2
+                return line
+            if self._fill() == 0:
+                raise ConnectionClosed('connection closed in the middle of a header')
+
+    def read_head(self):
+        # Returns (status line, [(name, value)]), 1xx interim responses are skipped
+        while True:
+            status_line = self.read_line().decode('latin-1')
+            headers = []
+            while True:
+                line = self.read_line()
+                if not line:
+                    break
+                name, sep, value = line.decode('latin-1').partition(':')
+                if sep:
+                    headers.append((name.strip(), value.strip()))
+            parts = status_line.split()
+            if len(parts) < 2 or not parts[1].isdigit():
+                raise ValueError('malformed status line: ' + status_line)
+            if not parts[1].startswith('1'):
+                return status_line, headers
+
+    def _read_exact(self, count):
+        while count > 0:
+            if self.start == self.end and self._fill() == 0:
+                raise ConnectionClosed(f'connection closed with {count} body bytes missing')
+            take = min(count, self.end - self.start)
+            yield self.view[self.start:self.start + take]
+            self.start += take
+            count -= take
+
+    def body(self, status_line, headers, method='GET'):
+        # Generator over the decoded body, framed by chunked encoding, Content-Length or connection close
+        version, status = status_line.split()[:2]
+        header_map = {name.lower(): value for name, value in headers}
+        connection = header_map.get('connection', '').lower()
+        keep_alive = version == 'HTTP/1.1' and 'close' not in connection
+
+        if method == 'HEAD' or status in ('204', '304'):
+            pass
+        elif 'chunked' in header_map.get('transfer-encoding', '').lower():
+            while True:
+                size_line = self.read_line()
+                size = int(size_line.split(b';')[0].strip(), 16)
+                if size == 0:
+                    # skip any trailer headers up to the final blank line
+                    while self.read_line():
+                        pass
+                    break
+                yield from self._read_exact(size)
+                if self.read_line():
+                    raise ValueError('chunk not followed by CRLF')
+        elif header_map.get('content-length', '').isdigit():
+            yield from self._read_exact(int(header_map['content-length']))
+        else:
+            # the end of the body is only known when the origin closes
+            keep_alive = False
+            while True:
+                if self.start == self.end and self._fill() == 0:
+                    break
+                yield self.view[self.start:self.end]
+                self.start = self.end
+
+        # leftover bytes would belong to a response we never asked for
+        self.reusable = keep_alive and self.start == self.end
+
+
+class Resolver:
+    # Cache of getaddrinfo results with a TTL, failures are cached too for a shorter time
+    # Lookups run on a small thread pool, concurrent requests for one name share a single lookup
+    def __init__(self, ttl=DNS_TTL, negative_ttl=DNS_NEGATIVE_TTL, threads=RESOLVER_THREADS):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.entries = {}   # (host, port) -> (expiry time, [(family, sockaddr)] or the gaierror)
+        self.pending = {}   # (host, port) -> Future of a lookup in progress
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='resolver')
+
+    def resolve(self, host, port):
+        # Returns [(family, sockaddr)] to try in order, raises gaierror for a name that does not resolve
+        name = (host, port)
+        now = time.monotonic()
+        with self.lock:
+            cached = self.entries.get(name)
+            if cached is not None and now < cached[0]:
+                expires, result = cached
+                if not isinstance(result, Exception) and expires - now < self.ttl * DNS_PREFETCH_FRACTION:
+                    # still good, but refresh it now so the next request does not wait for the resolver
+                    self._lookup_async(name)
+                future = None
+            else:
+                future = self._lookup_async(name)
+        if future is not None:
+            result = future.result()
+        if isinstance(result, Exception):
+            # a new exception each time, re-raising the cached one would keep growing its traceback
+            raise gaierror(*result.args)
+        return result
+
+    def _lookup_async(self, name):
+        # caller holds the lock
+        future = self.pending.get(name)
+        if future is None:
+            future = self.pending[name] = self.executor.submit(self._lookup, name)
+        return future
+
+    def _lookup(self, name):
+        host, port = name
+        try:
+            try:
+                infos = getaddrinfo(host, port, 0, SOCK_STREAM)
+                result = [(family, sockaddr) for family, _, _, _, sockaddr in infos]
+                ttl = self.ttl
+            except gaierror as err:
+                result = err
+                ttl = self.negative_ttl
+            # the hostname comes from the client, the IDNA codec rejects e.g. a label over 63 characters
+            except ValueError as err:
+                result = gaierror(f'cannot resolve {host!r}: {err}')
+                ttl = self.negative_ttl
+            now = time.monotonic()
+            with self.lock:
+                cached = self.entries.get(name)
+                if isinstance(result, Exception) and cached is not None and not isinstance(cached[1], Exception) \
+                        and now < cached[0]:
+                    # a failed prefetch does not throw away an address that is still valid
+                    result = cached[1]
+                else:
+                    self.entries[name] = (now + ttl, result)
+                if len(self.entries) > DNS_MAX_ENTRIES:
+                    for key in [key for key, (expires, _) in self.entries.items() if expires <= now]:
+                        del self.entries[key]
+        finally:
+            # whatever happened, the next resolve of this name must not find a finished future
+            with self.lock:
+                del self.pending[name]
+        return result
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class ConnectionPool:
+    # Idle persistent connections to origin servers, keyed by (host, port)
+    def __init__(self, max_idle=8, idle_timeout=30, connect_timeout=10, resolver=None):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.resolver = resolver or Resolver()
+        self.lock = threading.Lock()
+        self.idle = {}   # (host, port) -> deque of (socket, time it went idle)
+
+    def acquire(self, origin):
+        # Returns (socket, reused), an idle connection if a healthy one exists, otherwise a new one
+        while True:
+            with self.lock:
+                connections = self.idle.get(origin)
+                if not connections:
+                    break
+                # most recently used first, it is the least likely to have been closed by the origin
+                sock, idle_since = connections.pop()
+            if time.monotonic() - idle_since < self.idle_timeout and self.healthy(sock):
+                return sock, True
+            sock.close()
+        return self.connect(origin), False
+
+    def connect(self, origin):
+        # New connection to the origin, trying each of its cached addresses in turn
+        error = None
+        for family, sockaddr in self.resolver.resolve(*origin):
+            sock = socket(family, SOCK_STREAM)
+            sock.settimeout(self.connect_timeout)
+            try:
+                sock.connect(sockaddr)
+                return sock
+            except OSError as err:
+                sock.close()
+                error = err
+        raise error or OSError(f'no addresses for {origin[0]}')
+
+    def release(self, origin, sock):
+        # Hand a connection back after a complete response so the next request can reuse it
+        now = time.monotonic()
+        with self.lock:
+            connections = self.idle.setdefault(origin, deque())
+            # drop connections that have been idle too long, oldest are on the left
+            while connections and now - connections[0][1] >= self.idle_timeout:
+                connections.popleft()[0].close()
+            if len(connections) < self.max_idle:
+                connections.append((sock, now))
+                return
+        sock.close()
+
+    def discard(self, sock):
+        sock.close()
+
+    @staticmethod
+    def healthy(sock):
+        # An idle connection should have nothing to read, readable means the origin closed it (or misbehaved)
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for sock, idle_since in connections:
+                    sock.close()
+            self.idle.clear()
+        self.resolver.close()
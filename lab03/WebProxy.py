@@ -1,145 +1,564 @@
 from socket import *
+import argparse
+import json
+import logging
 import os
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import ProxyCache
+import ProxyStats
+import Upstream
 
-# Create a server socket, bind it to a port and start listening
-proxySerSock = socket(AF_INET, SOCK_STREAM)
-#fill in start.
 server_name = 'localhost'
 server_port = 8888
-proxySerSock.bind((server_name, server_port))
-proxySerSock.listen(1)
-#fill in end.
-
-while 1:
-    print('Ready to serve...')
-    #accept connection from clients
-    proxyCliSock, addr = proxySerSock.accept()#Fill in start #Fill in end
-    print('Received a connection from:', addr)
-
-    # get the http request from client
-    message = proxyCliSock.recv(1024).decode() # fill in start  # fill in end
-    print(message)
-
-    # if message is not a GET request send a response 400 Bad request to the client
-    #close the connection and go to the next iteration of while loop waiting for another request
-    #from the same or a different client
-    if not message.startswith("GET"):
-        print("message is not a GET")
-        # fill in start.
-        bad_request =  "HTTP/1.0 400 Bad Request\r\nConnection: close\r\n\r\n"
-        proxyCliSock.send(bad_request.encode())
-        proxyCliSock.close()
-        # fill in end.
-        continue
+# Most client connections handled at the same time, further clients wait in the listen backlog
+MAX_CLIENTS = 64
+# Seconds a client may take to send its request
+CLIENT_TIMEOUT = 10
+# Seconds to connect to the origin server and between bytes received from it
+ORIGIN_TIMEOUT = 10
+# Largest request header block accepted from a client
+MAX_REQUEST_SIZE = 64 * 1024
+# Size of the reusable buffer each relay receives origin data into
+RELAY_BUFFER_SIZE = 64 * 1024
+# Headers that only describe the proxy-origin connection and are not forwarded to the client
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-connection', 'te', 'trailer', 'transfer-encoding', 'upgrade'}
+# Idle persistent connections kept per origin server
+ORIGIN_MAX_IDLE = 8
+# Seconds an idle origin connection is kept before it is closed
+ORIGIN_IDLE_TIMEOUT = 30
+
+# Default on-disk cache budget
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# Default budget of the in-memory tier and the largest object it holds
+MEMORY_MAX_BYTES = 64 * 1024 * 1024
+MEMORY_MAX_OBJECT_BYTES = 1024 * 1024
+
+log = logging.getLogger('proxy')
+
+# Set by SIGTERM/SIGINT, the accept loop stops and in-flight requests finish
+stopping = threading.Event()
+# ProxyCache.CacheManager shared by every worker thread, created in main
+cache = None
+# ProxyCache.MemoryCache of popular small objects in front of the disk cache, created in main
+memory = None
+# Upstream.ConnectionPool of persistent origin connections, created in main
+pool = None
+# Hit/miss counters and latency histograms, served on GET /__stats
+stats = ProxyStats.ProxyStats()
+# Origin fetches in progress by cache key, concurrent misses for a key follow the first one
+downloads = {}
+downloads_lock = threading.Lock()
+
+
+def receive_request(proxyCliSock):
+    # Read from the client until the end of the request header block
+    message = b''
+    while b'\r\n\r\n' not in message:
+        chunk = proxyCliSock.recv(4096)
+        if not chunk:
+            break
+        message += chunk
+        if len(message) > MAX_REQUEST_SIZE:
+            break
+    return message
+
+
+def header_value(headers, name):
+    # First value of a header, case insensitive, or None
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def client_header(status_line, headers):
+    # Header block for the client: hop-by-hop headers are dropped since every client connection is closed
+    lines = [status_line]
+    for name, value in headers:
+        if name.lower() not in HOP_BY_HOP:
+            lines.append(f'{name}: {value}')
+    lines.append('Connection: close')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def cached_header(entry):
+    # Response header for a cached object
+    response_header = "HTTP/1.0 200 OK\r\n"
+    if entry.content_type:
+        response_header += f"Content-Type: {entry.content_type}\r\n"
+    if entry.etag:
+        response_header += f"ETag: {entry.etag}\r\n"
+    if entry.last_modified:
+        response_header += f"Last-Modified: {entry.last_modified}\r\n"
+    response_header += f"Content-Length: {entry.size}\r\nConnection: close\r\n\r\n"
+    return response_header.encode('latin-1')
+
+
+def send_cached(proxyCliSock, entry, f):
+    # Send http response header and object, the file is streamed by the kernel
+    #fill in start
+    stats.first_byte()
+    proxyCliSock.sendall(cached_header(entry))
+    proxyCliSock.sendfile(f)
+    #fill in end
+
+
+def send_buffers(sock, buffers):
+    # Send the buffers with scatter/gather sendmsg, a partial send only slices a memoryview, nothing is copied
+    views = [memoryview(buffer) for buffer in buffers]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views:
+            views[0] = views[0][sent:]
+
 
-    # Extract the pathname(including the filename) and hostname from the given message
-    slashPlusUrl = message.split()[1]
-    url = slashPlusUrl.partition("/")[2]
-    # fill in start
-    hostn = url.split('/')[0]
-    pathname = url.split('/', 1)[1]
-    # fill in end.
-    pathname = "/" + pathname
-    # remove "www." from the hostname if it starts with "www."
-    if hostn.startswith("www."):
-        hostn = hostn.replace("www.", "", 1)
+def promote(key, entry, f):
+    # Copy an object served from disk into the memory tier if it is popular enough to earn a place
+    if not memory.wants(key, entry.size):
+        return
+    f.seek(0)
+    body = f.read(entry.size + 1)
+    if len(body) == entry.size:
+        memory.put(key, entry, cached_header(entry), body)
 
-    print("pathname: " , pathname)
-    print("hostname: ", hostn)
 
-    fileExist = "false"
+class Download:
+    # An origin fetch in progress, the leader writes the body to a file that followers stream from
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.head = None        # header block sent to every client
+        self.path = None        # file receiving the body, renamed into the cache once complete
+        self.received = 0       # body bytes in the file so far
+        self.done = False       # the leader finished, successfully or not
+        self.complete = False   # the whole body was received and renamed into place
 
-    directory = "./" + url
+    def publish(self, head, path):
+        with self.cond:
+            self.head = head
+            self.path = path
+            self.cond.notify_all()
 
+    def progress(self, received):
+        with self.cond:
+            self.received = received
+            self.cond.notify_all()
+
+    def commit(self, tmp_path, path):
+        # rename under the lock, so a follower opens either the temporary or the final name
+        with self.cond:
+            os.replace(tmp_path, path)
+            self.path = path
+            self.complete = True
+
+    def finish(self):
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+
+
+def begin_download(key):
+    # Returns (download, True) for the first miss of a key, or (download in progress, False)
+    with downloads_lock:
+        download = downloads.get(key)
+        if download is not None:
+            return download, False
+        download = downloads[key] = Download()
+        return download, True
+
+
+def end_download(key, download):
+    with downloads_lock:
+        if downloads.get(key) is download:
+            del downloads[key]
+    download.finish()
+
+
+def follow_download(download, proxyCliSock):
+    # Stream a response another thread is downloading, as its bytes arrive
+    # Returns False when the leader had no body to share (an error, a 304 or an uncacheable response)
+    with download.cond:
+        download.cond.wait_for(lambda: download.path is not None or download.done)
+        if download.path is None:
+            return False
+        try:
+            f = open(download.path, 'rb')
+        except OSError:
+            # the leader gave up on a partial body, or the object was already evicted
+            return False
+    with f:
+        stats.first_byte()
+        sent, complete = stream_download(download, proxyCliSock, f)
+    stats.add('bytes_from_coalesced', sent)
+    if not complete:
+        log.warning("Origin response ended early, followed %d body bytes", sent)
+    return True
+
+
+def stream_download(download, proxyCliSock, f):
+    # Send the head, then the body from f as the download writes it
+    # Returns (body bytes sent, whether the whole body arrived)
+    proxyCliSock.sendall(download.head)
+    sent = 0
+    while True:
+        with download.cond:
+            download.cond.wait_for(lambda: download.received > sent or download.done)
+            received, done, complete = download.received, download.done, download.complete
+        if received > sent:
+            proxyCliSock.sendfile(f, sent, received - sent)
+            sent = received
+        elif done:
+            return sent, complete
+
+
+def send_leader(download, proxyCliSock, f, key):
+    # Runs on its own thread, so the leader's client reads the cache file at its own pace like any follower
     try:
-        # Check whether the file exist in the cache using open() method
-        # If file exists it opens file and reads otherwise it throws as exception
-        f = open(directory, "rb")
-        object = f.read()
-
-        # Send http response header and object
-        #fill in start
-        response_header = "HTTP/1.0 200 OK\r\nConnection: close\r\n\r\n"
-        proxyCliSock.send(response_header.encode() + object)
-        #fill in end
-
-        fileExist = "true"
-        print('Read from cache')
-        #close socket and file
-        #fill in start
-        f.close()
-        proxyCliSock.close()
-        #fill in end
-
-    except IOError: # Error handling for file not found in cache
-
-        if fileExist == "false":
-            # Create a socket on the proxyserver to connect to the original server on port 80
-            proxyAsClientSocket = socket(AF_INET, SOCK_STREAM) #Fill in start #Fill in end
-            # Connect to the original server on port 80
-            proxyAsClientSocket.connect((hostn, 80)) #Fill in start #Fill in end
-
-
-            #create a get request message and send the message to the server using the socket just created in above lines
-            # Hint : use pathname and hostn in the request message
-
-            #fill in start
-            request_message = f"GET {pathname} HTTP/1.0\r\nHost: {hostn}\r\nConnection: close\r\n\r\n"
-            proxyAsClientSocket.send(request_message.encode())
-            #fill in end
-
-            # initialize response to empty in binary format - works for any type of document
-            total_response = b''
-
-            # receive data from web server
-            #Hint: You can use a while loop and get response in chunks until it is finished.
-            #Fill in start
-            while True: 
-                chunk = proxyAsClientSocket.recv(1024)
-                if not chunk: 
-                    break
-                total_response += chunk
-            print(f"Recieved  this response: \n {total_response}   \n it is this many bytes: {len(total_response)}")
-            #Fill in end
-
-            #Separate header and object
-            #Hint use split function. Check the lecture notes to see what separates the response header and object
-            response_header = total_response.split(b'\r\n\r\n', 1)[0] #Fill in start #Fill in end
-            response_object = total_response.split(b'\r\n\r\n', 1)[1]#Fill in start #Fill in end
-
-
-            if b'200 OK' in response_header:
-                # if the response is a 200 OK response create the directory and file and write the object into the file
-                # Then, send http response header and object to the client
-                #Fill in start
-                os.makedirs(os.path.dirname(directory), exist_ok=True)
-                
-                f = open(directory, "wb") 
-                f.write(response_object)
-                f.close()
-
-                proxy_response_header = "HTTP/1.0 200 OK\r\nConnection: close\r\n\r\n"
-                proxyCliSock.send(total_response)
-                #Fill in end
-            else:
-                #Otherwise, i.e., if response is not a 200 OK message,send 400 bad response
-                #Fill in start
-                bad_request =  "HTTP/1.0 400 Bad Request\r\nConnection: close\r\n\r\n"
-                proxyCliSock.send(bad_request.encode())
-                #Fill in end
-
-            # close socket between proxy and origin server
-            proxyAsClientSocket.close()
+        with f:
+            stream_download(download, proxyCliSock, f)
+    except OSError as err:
+        log.info("Client went away during the relay of %s: %s", key, err)
+
+
+def relay_response(reader, status_line, headers, proxyCliSock, key, download, stale=None):
+    # Stream the origin response to the client as it arrives, teeing a cacheable 200 OK body into the cache
+    # download is shared with clients following this fetch, the body is published through it while cached
+    # stale is (entry, open file) when the request was a revalidation of a cached copy
+    status = int(status_line.split()[1])
+    header_map = {name.lower(): value for name, value in headers}
+    body = reader.body(status_line, headers)
+
+    if status == 304 and stale is not None:
+        # a 304 has no body, but reading it leaves the connection ready for reuse
+        for chunk in body:
+            pass
+        # our copy is still good: serve it and give it a new lifetime
+        entry, f = stale
+        validators = {'last-modified': entry.last_modified} if entry.last_modified else {}
+        validators.update(header_map)
+        cacheable, expires = ProxyCache.freshness(validators)
+        cache.refresh(key, expires)
+        # clients waiting on this download can serve the refreshed copy themselves
+        end_download(key, download)
+        send_cached(proxyCliSock, entry, f)
+        stats.add('hits_revalidated')
+        stats.add('bytes_from_disk', entry.size)
+        log.debug("Revalidated %s, origin answered 304", key)
+        return
+
+    stats.add('misses')
+    # a chunked body reaches the client decoded and ended by the close
+    if 'chunked' in header_map.get('transfer-encoding', '').lower():
+        headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+    head = client_header(status_line, headers)
+
+    cacheable, expires = ProxyCache.freshness(header_map)
+    directory = cache.path_for(key)
+    cache_file = None
+    if status == 200 and cacheable:
+        # write to a temporary name and only rename it into place once the body is complete
+        # unbuffered, so clients following this download can read every chunk as soon as it is written
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        cache_file = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(directory), prefix='.tmp-', delete=False, buffering=0)
+        download.publish(head, cache_file.name)
+    else:
+        # nothing will be shared, clients waiting on this download fetch on their own straight away
+        end_download(key, download)
+
+    sender = None
+    try:
+        stats.first_byte()
+        if cache_file:
+            # the body only goes to the cache file here, the client is fed from that file by another thread
+            # so a slow client cannot hold back the download for the cache and every follower
+            sender = threading.Thread(target=send_leader, name=threading.current_thread().name + '-send',
+                                      args=(download, proxyCliSock, open(cache_file.name, 'rb'), key))
+            sender.start()
         else:
-            break
-    except:
-        print("An Exception Occurred")
+            proxyCliSock.sendall(head)
+        received = 0
+        for chunk in body:
+            if cache_file:
+                cache_file.write(chunk)
+                download.progress(received + len(chunk))
+            else:
+                proxyCliSock.sendall(chunk)
+            received += len(chunk)
+
+        stats.add('bytes_from_origin', received)
+        log.debug("Relayed %s (%d body bytes) for %s", status_line, received, key)
+        if cache_file:
+            cache_file.close()
+            download.commit(cache_file.name, directory)
+            cache.store(key, received, expires, header_map.get('content-type'),
+                        header_map.get('etag'), header_map.get('last-modified'))
+            cache_file = None
     finally:
+        if cache_file:
+            # truncated by the origin, never cache half an object
+            cache_file.close()
+            os.unlink(cache_file.name)
+        if sender is not None:
+            # the sender stops once the download is done and it has sent what arrived
+            download.finish()
+            sender.join()
+
+
+def fetch_from_origin(origin, request_message):
+    # Send a request over a pooled connection and read the response head
+    # A reused connection may have been closed by the origin while idle, so that case is retried once on a new one
+    while True:
+        started = time.perf_counter()
+        originSock, reused = pool.acquire(origin)
+        try:
+            originSock.sendall(request_message)
+            reader = Upstream.ResponseReader(originSock, RELAY_BUFFER_SIZE)
+            status_line, headers = reader.read_head()
+            stats.origin_fetched(time.perf_counter() - started)
+            return originSock, reader, status_line, headers
+        except (OSError, Upstream.ConnectionClosed):
+            pool.discard(originSock)
+            if not reused:
+                raise
+
+
+def fetch_object(proxyCliSock, hostn, pathname, key, download, entry=None, f=None):
+    # Fetch the object from the origin and relay it, entry and its open file f are a stale copy to revalidate
+    # Get a connection to the original server on port 80, reusing an idle one when possible
+    origin = (hostn, 80)
+
+    #create a get request message and send the message to the server using the socket just created in above lines
+    # Hint : use pathname and hostn in the request message
+
+    #fill in start
+    request_message = f"GET {pathname} HTTP/1.1\r\nHost: {hostn}\r\n"
+    if entry is not None:
+        request_message += entry.conditional_headers()
+    request_message += "Connection: keep-alive\r\n\r\n"
+    proxyAsClientSocket, reader, status_line, headers = fetch_from_origin(
+        origin, request_message.encode('latin-1'))
+    #fill in end
+
+    try:
+        relay_response(reader, status_line, headers, proxyCliSock, key, download,
+                       stale=(entry, f) if entry is not None else None)
+    except BaseException:
+        # the response was not read to its end, the connection cannot be reused
+        pool.discard(proxyAsClientSocket)
+        raise
+    # keep the connection between proxy and origin server open for the next request
+    if reader.reusable:
+        pool.release(origin, proxyAsClientSocket)
+    else:
+        pool.discard(proxyAsClientSocket)
+
+
+def send_stats(proxyCliSock, addr):
+    # GET /__stats: counters and histograms as JSON, only answered to clients on this machine
+    if addr[0] not in ('127.0.0.1', '::1'):
+        proxyCliSock.sendall(b"HTTP/1.0 403 Forbidden\r\nConnection: close\r\n\r\n")
+        return
+    snapshot = stats.snapshot()
+    snapshot['memory_cache'] = {'objects': len(memory.objects), 'bytes': memory.used_bytes}
+    snapshot['disk_cache'] = {'objects': len(cache.entries), 'bytes': cache.used_bytes}
+    body = json.dumps(snapshot, indent=2).encode()
+    response_header = (f"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n"
+                       f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+    proxyCliSock.sendall(response_header.encode() + body)
+
+
+def handle_client(proxyCliSock, addr):
+    # Serve one client connection, runs on a worker thread
+    log.debug('Received a connection from: %s', addr)
+    stats.connection_opened()
+    try:
+        proxyCliSock.settimeout(CLIENT_TIMEOUT)
+
+        # get the http request from client
+        message = receive_request(proxyCliSock).decode('latin-1') # fill in start  # fill in end
+        stats.begin_request()
+        log.debug('%s', message)
+
+        # if message is not a GET request send a response 400 Bad request to the client
+        #close the connection and go to the next request
+        if not message.startswith("GET"):
+            log.debug("message is not a GET")
+            # fill in start.
+            bad_request =  "HTTP/1.0 400 Bad Request\r\nConnection: close\r\n\r\n"
+            proxyCliSock.send(bad_request.encode())
+            # fill in end.
+            return
+
+        # Extract the pathname(including the filename) and hostname from the given message
+        slashPlusUrl = message.split()[1]
+        if slashPlusUrl == '/__stats':
+            send_stats(proxyCliSock, addr)
+            return
+        url = slashPlusUrl.partition("/")[2]
+        # fill in start
+        hostn = url.split('/')[0]
+        pathname = url.split('/', 1)[1] if '/' in url else ''
+        # fill in end.
+        pathname = "/" + pathname
+        # remove "www." from the hostname if it starts with "www."
+        if hostn.startswith("www."):
+            hostn = hostn.replace("www.", "", 1)
+
+        log.debug("pathname: %s", pathname)
+        log.debug("hostname: %s", hostn)
+        # cached objects are stored under a hash of the normalized url
+        key = ProxyCache.normalize_url(url)
+
+        for attempt in range(2):
+            # Fresh objects are served from memory or the disk cache, stale ones are revalidated with the origin
+            entry = cache.lookup(key)
+            if entry is not None and entry.fresh():
+                hot = memory.get(key, entry)
+                if hot is not None:
+                    stats.first_byte()
+                    send_buffers(proxyCliSock, [hot.header, hot.body])
+                    stats.add('hits_memory')
+                    stats.add('bytes_from_memory', entry.size)
+                    log.debug('Read from memory cache')
+                    return
+
+            f = None
+            if entry is not None:
+                try:
+                    # Check whether the file exist in the cache using open() method
+                    # If file exists it opens file otherwise it throws as exception
+                    f = open(cache.path_for(key), "rb")
+                except IOError: # Error handling for file removed behind our back
+                    cache.remove(key)
+                    entry = None
+
+            try:
+                if entry is not None and entry.fresh():
+                    send_cached(proxyCliSock, entry, f)
+                    stats.add('hits_disk')
+                    stats.add('bytes_from_disk', entry.size)
+                    log.debug('Read from cache')
+                    promote(key, entry, f)
+                    return
+
+                # the first miss of an object fetches it, concurrent misses stream from that fetch
+                # the second attempt fetches on its own, the fetch it followed had nothing to share
+                if attempt == 0:
+                    download, leader = begin_download(key)
+                else:
+                    download, leader = Download(), True
+                if not leader:
+                    if follow_download(download, proxyCliSock):
+                        stats.add('hits_coalesced')
+                        log.debug('Followed an in-flight download')
+                        return
+                    # a 304 may have refreshed the cached copy, look again
+                    continue
+                try:
+                    fetch_object(proxyCliSock, hostn, pathname, key, download, entry, f)
+                finally:
+                    end_download(key, download)
+                return
+            finally:
+                if f is not None:
+                    f.close()
+    except timeout:
+        log.info("Connection timed out: %s", addr)
+    except Exception as err:
+        log.warning("An Exception Occurred: %s", err)
+    finally:
+        stats.connection_closed()
         # close socket between proxy and client
         proxyCliSock.close()
-    break #to test file with multiple objects. If the tested URLs have only one object you can remove "break"
 
 
-#close the main proxy listening socket
-proxySerSock.close()
-print("finish")
\ No newline at end of file
+def request_shutdown(signum, frame):
+    stopping.set()
+
+
+def serve(proxySerSock, max_clients):
+    # Accept clients until asked to stop, each one is handled on a pool thread
+    # the semaphore bounds the queue too, so a flood of clients waits in the kernel backlog
+    slots = threading.BoundedSemaphore(max_clients)
+    executor = ThreadPoolExecutor(max_workers=max_clients, thread_name_prefix='proxy')
+
+    def run(proxyCliSock, addr):
+        try:
+            handle_client(proxyCliSock, addr)
+        finally:
+            slots.release()
+
+    # wake up every second to notice a shutdown request
+    proxySerSock.settimeout(1)
+    log.info('Ready to serve on %s:%d', *proxySerSock.getsockname()[:2])
+    while not stopping.is_set():
+        if not slots.acquire(timeout=1):
+            continue
+        try:
+            #accept connection from clients
+            proxyCliSock, addr = proxySerSock.accept()#Fill in start #Fill in end
+        except timeout:
+            slots.release()
+            continue
+        proxyCliSock.settimeout(None)
+        executor.submit(run, proxyCliSock, addr)
+
+    log.info('Shutting down, waiting for in-flight requests...')
+    executor.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Caching web proxy.')
+    parser.add_argument('--host', help='Address to listen on.', default=server_name)
+    parser.add_argument('--port', help='Port.', type=int, default=server_port)
+    parser.add_argument('--max-clients', help='Client connections served at once.', type=int, default=MAX_CLIENTS)
+    parser.add_argument('--cache-dir', help='Directory holding cached objects.', default='.')
+    parser.add_argument('--cache-bytes', help='Disk budget of the cache in bytes.', type=int, default=CACHE_MAX_BYTES)
+    parser.add_argument('--memory-bytes', help='Memory budget of the hot object tier in bytes, 0 disables it.',
+                        type=int, default=MEMORY_MAX_BYTES)
+    parser.add_argument('--memory-object-bytes', help='Largest object kept in memory.',
+                        type=int, default=MEMORY_MAX_OBJECT_BYTES)
+    parser.add_argument('--origin-max-idle', help='Idle keep-alive connections kept per origin.',
+                        type=int, default=ORIGIN_MAX_IDLE)
+    parser.add_argument('--origin-idle-timeout', help='Seconds an idle origin connection is kept.',
+                        type=float, default=ORIGIN_IDLE_TIMEOUT)
+    parser.add_argument('--dns-ttl', help='Seconds a resolved origin address is reused.',
+                        type=float, default=Upstream.DNS_TTL)
+    parser.add_argument('--dns-negative-ttl', help='Seconds a failed resolution is remembered.',
+                        type=float, default=Upstream.DNS_NEGATIVE_TTL)
+    parser.add_argument('--log-level', help='Logging level, DEBUG logs every request.',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(threadName)s %(message)s')
+
+    cache = ProxyCache.CacheManager(args.cache_dir, args.cache_bytes)
+    memory = ProxyCache.MemoryCache(args.memory_bytes, args.memory_object_bytes)
+    resolver = Upstream.Resolver(args.dns_ttl, args.dns_negative_ttl)
+    pool = Upstream.ConnectionPool(args.origin_max_idle, args.origin_idle_timeout, ORIGIN_TIMEOUT, resolver)
+
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+    # Create a server socket, bind it to a port and start listening
+    proxySerSock = socket(AF_INET, SOCK_STREAM)
+    #fill in start.
+    proxySerSock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    proxySerSock.bind((args.host, args.port))
+    proxySerSock.listen(SOMAXCONN)
+    #fill in end.
+
+    serve(proxySerSock, args.max_clients)
+
+    #close the main proxy listening socket
+    proxySerSock.close()
+    pool.close()
+    cache.close()
+    log.info("finish")
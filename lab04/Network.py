@@ -6,6 +6,43 @@ import random
 import SWRDT
 
 
+## Byte stream with amortized O(1) append and consume
+# Consumed bytes are only dropped once they make up half of the buffer, so no call copies the whole backlog
+class StreamBuffer:
+    def __init__(self):
+        self.buffer = bytearray()
+        # first unread byte in buffer
+        self.start = 0
+
+    def __len__(self):
+        return len(self.buffer) - self.start
+
+    def append(self, data):
+        self.buffer += data
+
+    def peek(self, size=None):
+        # Zero-copy view of up to size unread bytes (all of them by default)
+        # Release it, e.g. with a with block, before the next append or consume: a bytearray cannot resize while viewed
+        end = len(self.buffer) if size is None else min(self.start + size, len(self.buffer))
+        return memoryview(self.buffer)[self.start : end]
+
+    def consume(self, size):
+        self.start = min(self.start + size, len(self.buffer))
+        if self.start == len(self.buffer):
+            self.buffer.clear()
+            self.start = 0
+        elif self.start > len(self.buffer) // 2:
+            del self.buffer[: self.start]
+            self.start = 0
+
+    def read(self, size=None):
+        # Remove and return up to size unread bytes (all of them by default) as bytes
+        with self.peek(size) as view:
+            data = bytes(view)
+        self.consume(len(data))
+        return data
+
+
 ## Provides an abstraction for the network layer
 class NetworkLayer:
     # configuration parameters
@@ -16,14 +53,26 @@ class NetworkLayer:
     # class variables
     sock = None
     conn = None
-    buffer_S = ""
-    lock = threading.Lock()
+    buffer_S = None
+    lock = None
     collect_thread = None
     stop = None
-    socket_timeout = 0.1
+    ## the peer closed the connection, nothing more will be collected
+    closed = False
+    ## called from the collector thread after data arrived, e.g. to wake an event loop
+    on_data = None
+    # the collector blocks in recv instead of waking up on a timeout, disconnect wakes it by shutting down reads
+    socket_timeout = None
     reorder_msg_S = None
 
-    def __init__(self, role_S, receiver_S, port):
+    def __init__(self, role_S, receiver_S, port, length_S_length=None):
+        # the segment length field is never corrupted, so the receiver can always find segment boundaries
+        self.length_S_length = length_S_length or SWRDT.Segment.length_S_length
+        # received bytes not yet delivered, per connection
+        self.buffer_S = StreamBuffer()
+        self.lock = threading.Lock()
+        # signalled by the collector whenever buffer_S grows or the connection closes
+        self.data_ready = threading.Condition(self.lock)
         if role_S == "sender":
             print("Network: role is sender")
             self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -46,6 +95,11 @@ class NetworkLayer:
     def disconnect(self):
         if self.collect_thread:
             self.stop = True
+            # wake the collector from its blocking recv
+            try:
+                self.conn.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
             self.collect_thread.join()
 
     def __del__(self):
@@ -55,14 +109,15 @@ class NetworkLayer:
             self.conn.close()
 
     def network_send(self, msg_S):
+        # msg_S is bytes, the network layer never encodes or decodes it
         # return without sending if the packet is being dropped
         if random.random() < self.prob_pkt_loss:
             return
         # corrupt a packet
         if random.random() < self.prob_byte_corr:
-            start = random.randint(SWRDT.Segment.length_S_length, len(msg_S) - 5)
+            start = random.randint(self.length_S_length, len(msg_S) - 5)
             num = random.randint(1, 5)
-            repl_S = "".join(random.sample("XXXXX", num))  # sample length >= num
+            repl_S = b"X" * num
             msg_S = msg_S[:start] + repl_S + msg_S[start + num :]
         # reorder packets - either hold a packet back, or if one held back then send both
         if random.random() < self.prob_pkt_reorder or self.reorder_msg_S:
@@ -76,7 +131,7 @@ class NetworkLayer:
         # keep calling send until all the bytes are transferred
         totalsent = 0
         while totalsent < len(msg_S):
-            sent = self.conn.send(msg_S[totalsent:].encode("utf-8"))
+            sent = self.conn.send(msg_S[totalsent:])
             if sent == 0:
                 raise RuntimeError("socket connection broken")
             totalsent = totalsent + sent
@@ -87,23 +142,36 @@ class NetworkLayer:
         while True:
             try:
                 recv_bytes = self.conn.recv(4096)
-                with self.lock:
-                    self.buffer_S += recv_bytes.decode("utf-8")
             # you may need to uncomment the BlockingIOError handling on Windows machines
             #             except BlockingIOError as err:
             #                 pass
             except socket.timeout as err:
-                pass
-            if self.stop:
+                recv_bytes = None
+            # reset, or shut down by disconnect
+            except OSError as err:
+                recv_bytes = b""
+            if recv_bytes is not None:
+                with self.data_ready:
+                    if recv_bytes:
+                        self.buffer_S.append(recv_bytes)
+                    else:
+                        self.closed = True
+                    self.data_ready.notify_all()
+                if self.on_data is not None:
+                    self.on_data()
+            if self.stop or self.closed:
                 #                 print (threading.currentThread().getName() + ': Ending')
                 return
 
     ## Deliver collected data to sender
     def network_receive(self):
         with self.lock:
-            ret_S = self.buffer_S
-            self.buffer_S = ""
-        return ret_S
+            return self.buffer_S.read()
+
+    ## Block until data is collected, the connection closes or timeout seconds pass (None waits for ever)
+    def wait(self, timeout=None):
+        with self.data_ready:
+            return self.data_ready.wait_for(lambda: len(self.buffer_S) or self.closed, timeout)
 
 
 if __name__ == "__main__":
@@ -119,7 +187,7 @@ if __name__ == "__main__":
 
     network = NetworkLayer(args.role, args.receiver, args.port)
     if args.role == "sender":
-        network.network_send("MSG_FROM_SENDER")
+        network.network_send(b"MSG_FROM_SENDER")
         sleep(2)
         print(network.network_receive())
         network.disconnect()
@@ -127,5 +195,5 @@ if __name__ == "__main__":
     else:
         sleep(1)
         print(network.network_receive())
-        network.network_send("MSG_FROM_RECEIVER")
+        network.network_send(b"MSG_FROM_RECEIVER")
         network.disconnect()
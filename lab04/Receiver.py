@@ -1,29 +1,29 @@
 import argparse
 import SWRDT
-import time
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Uppercase conversion receiver.")
     parser.add_argument("port", help="Port.", type=int)
+    parser.add_argument("--mode", help="Stop-and-wait, Go-Back-N or Selective Repeat.",
+                        choices=SWRDT.SWRDT.modes, default="sw")
+    parser.add_argument("--window", help="Window size of the pipelined modes.", type=int, default=8)
+    parser.add_argument("--format", help="Segment wire format, text with MD5 or binary with CRC32.",
+                        choices=list(SWRDT.SWRDT.wire_formats), default="text")
     args = parser.parse_args()
 
     timeout = 10
-    time_of_last_data = time.time()
 
-    swrdt = SWRDT.SWRDT("receiver", None, args.port)
+    swrdt = SWRDT.SWRDT("receiver", None, args.port, args.mode, args.window, args.format)
     
     
     while True:
 
-        # try to receive message before timeout
-        msg_S = swrdt.swrdt_receive()
-        if msg_S is not None:
-            time_of_last_data = time.time()
-            print(f"Received and delivered to application: '{msg_S}'\n")
-
-        if time_of_last_data + timeout < time.time():
+        # block until a message is delivered, or give up after timeout
+        msg_S = swrdt.swrdt_receive(timeout=timeout)
+        if msg_S is None:
             print("\nReceiver timeout - no data received for too long")
             break
+        print(f"Received and delivered to application: '{msg_S}'\n")
 
     swrdt.disconnect()
     print("\n--- End ---")
\ No newline at end of file
@@ -1,7 +1,12 @@
 import Network
 import argparse
+import asyncio
+import heapq
+from collections import deque
 from time import sleep, time
 import hashlib
+import struct
+import zlib
 
 
 class Segment:
@@ -34,12 +39,12 @@ class Segment:
     def get_byte_S(self):
         # convert sequence number of a byte field of seq_num_S_length bytes
         seq_num_S = str(self.seq_num).zfill(self.seq_num_S_length)
-        # convert length to a byte field of length_S_length bytes
+        # convert length to a byte field of length_S_length bytes, the length is counted in encoded bytes
         length_S = str(
             self.length_S_length
             + len(seq_num_S)
             + self.checksum_length
-            + len(self.msg_S)
+            + len(self.msg_S.encode("utf-8"))
         ).zfill(self.length_S_length)
         # compute the checksum
         checksum = hashlib.md5((length_S + seq_num_S + self.msg_S).encode("utf-8"))
@@ -70,21 +75,177 @@ class Segment:
         # and check if the same
         return checksum_S != computed_checksum_S
 
+    @classmethod
+    def ack(cls, seq_num):
+        return cls(seq_num, "")
+
+    def is_ack(self):
+        return self.msg_S == ""
+
+    ## bytes interface used by SWRDT, shared with BinarySegment
+    def to_bytes(self):
+        return self.get_byte_S().encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        # a corrupted multi-byte character decodes to U+FFFD, which the checksum then rejects
+        return cls.from_byte_S(bytes(buffer).decode("utf-8", errors="replace"))
+
+    @classmethod
+    def frame_length(cls, buffer):
+        # Length of the segment at the start of buffer, None until its length field has arrived
+        if len(buffer) < cls.length_S_length:
+            return None
+        return int(bytes(buffer[: cls.length_S_length]))
+
+
+class BinarySegment:
+    # Compact wire format: a fixed 13 byte header instead of Segment's 52 characters, and CRC32 instead of MD5
+    ## length, sequence number and flags, in network byte order
+    fields = struct.Struct("!IIB")
+    ## CRC32 over the fields and the payload
+    checksum_field = struct.Struct("!I")
+    header_length = fields.size + checksum_field.size
+    ## the number of bytes used to store segment length
+    length_S_length = 4
+
+    ## flags
+    ACK = 0x01
+    TEXT = 0x02  # the payload is UTF-8 text and is delivered as str
+
+    def __init__(self, seq_num, msg_S, flags=0):
+        self.seq_num = int(seq_num)
+        self.msg_S = msg_S
+        self.flags = flags
+
+    @classmethod
+    def ack(cls, seq_num):
+        return cls(seq_num, b"", cls.ACK)
+
+    def is_ack(self):
+        return bool(self.flags & self.ACK)
+
+    def to_bytes(self):
+        payload = self.msg_S
+        flags = self.flags
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+            flags |= self.TEXT
+        fields = self.fields.pack(self.header_length + len(payload), self.seq_num, flags)
+        checksum = zlib.crc32(payload, zlib.crc32(fields))
+        return fields + self.checksum_field.pack(checksum) + payload
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        # buffer is parsed through a memoryview, only the payload handed to the application is copied
+        view = memoryview(buffer)
+        if cls.corrupt(view):
+            raise RuntimeError("Cannot initialize Segment: byte_S is corrupt")
+        length, seq_num, flags = cls.fields.unpack_from(view)
+        payload = view[cls.header_length : length]
+        msg_S = str(payload, "utf-8") if flags & cls.TEXT else bytes(payload)
+        return cls(seq_num, msg_S, flags & ~cls.TEXT)
+
+    @classmethod
+    def corrupt(cls, view):
+        if len(view) < cls.header_length:
+            return True
+        length = cls.fields.unpack_from(view)[0]
+        (checksum,) = cls.checksum_field.unpack_from(view, cls.fields.size)
+        computed = zlib.crc32(view[cls.header_length :], zlib.crc32(view[: cls.fields.size]))
+        return length != len(view) or checksum != computed
+
+    @classmethod
+    def frame_length(cls, buffer):
+        # Length of the segment at the start of buffer, None until its header has arrived
+        if len(buffer) < cls.header_length:
+            return None
+        return cls.fields.unpack_from(buffer)[0]
+
+
+class RTOEstimator:
+    # Retransmission timeout from measured round trip times, Jacobson/Karels as in RFC 6298
+    # The maximum is far below RFC 6298's 60 s, a backed off sender must not outlast Receiver.py's 10 s idle timeout
+    alpha = 1 / 8
+    beta = 1 / 4
+    k = 4
+
+    def __init__(self, initial_rto, min_rto=0.05, max_rto=3):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.base_rto = initial_rto
+        self.backoffs = 0
+
+    @property
+    def rto(self):
+        return min(self.base_rto * 2 ** self.backoffs, self.max_rto)
+
+    def sample(self, rtt):
+        # RTT of a segment that was never retransmitted (Karn's rule)
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+        self.base_rto = min(max(self.srtt + self.k * self.rttvar, self.min_rto), self.max_rto)
+
+    def backoff(self):
+        # A timer expired: double the timeout, up to the maximum
+        if self.rto < self.max_rto:
+            self.backoffs += 1
+
+    def acknowledged(self):
+        # New data was acknowledged, the path works again so the backoff is dropped
+        # even when Karn's rule leaves the ACK without an RTT sample
+        self.backoffs = 0
+
 
 class SWRDT:
     ## latest sequence number used in a segment
     seq_num = 1
-    ## buffer of bytes read from network
-    byte_buffer = ""
+    ## buffer of bytes read from network, a Network.StreamBuffer per connection
+    byte_buffer = None
 
     expected_seq_num = 1
     sender_state = 'S_A'
     current_segment = None
-    timeout_duration = 2
-
-    def __init__(self, role_S, receiver_S, port):
-        self.network = Network.NetworkLayer(role_S, receiver_S, port)
+    ## initial retransmission timeout (RFC 6298), adapted to the measured RTT afterwards
+    timeout_duration = 1
+
+    ## modes: stop-and-wait, Go-Back-N and Selective Repeat
+    modes = ("sw", "gbn", "sr")
+    ## wire formats: Segment's text header with MD5, or BinarySegment's struct header with CRC32
+    wire_formats = {"text": Segment, "binary": BinarySegment}
+
+    def __init__(self, role_S, receiver_S, port, mode="sw", window_size=8, wire_format="text"):
+        if mode not in self.modes:
+            raise ValueError(f"Unknown mode {mode!r}, expected one of {self.modes}")
+        if wire_format not in self.wire_formats:
+            raise ValueError(f"Unknown wire format {wire_format!r}, expected one of {tuple(self.wire_formats)}")
+        self.segment_class = self.wire_formats[wire_format]
+        self.network = Network.NetworkLayer(role_S, receiver_S, port, self.segment_class.length_S_length)
+        self.byte_buffer = Network.StreamBuffer()
         self.role = role_S
+        self.mode = mode
+        self.rto = RTOEstimator(self.timeout_duration)
+        # stop-and-wait: the current segment was sent more than once, its ACK gives no RTT sample
+        self.retransmitted = False
+        # stop-and-wait is a window of one
+        self.window_size = 1 if mode == "sw" else window_size
+
+        # pipelined sender: seq_num -> [segment, time last sent, retransmitted] for every unacknowledged segment, oldest first
+        self.unacked = {}
+        # Go-Back-N has a single timer, running while anything is unacknowledged
+        self.timer_start = None
+        # Selective Repeat receiver: segments that arrived ahead of a gap, and messages ready for the application
+        self.out_of_order = {}
+        self.ready = deque()
+        # retransmission timer queue: heap of (time sent, seq_num), seq_num is None for Go-Back-N's single timer
+        # restarting or stopping a timer leaves its old entry behind, stale entries are dropped when they surface
+        self.timers = []
 
     def disconnect(self):
         self.network.disconnect()
@@ -93,17 +254,22 @@ class SWRDT:
 
     def swrdt_send(self, msg_S):
 
+        if self.role == "sender" and self.mode != "sw":
+            return self._window_send(msg_S)
+
         if self.role == "sender": 
             if self.sender_state == 'S_A':
                 # Create and send segment with current sequence number
-                self.current_segment = Segment(self.seq_num, msg_S)
-                segment_bytes = self.current_segment.get_byte_S()
+                self.current_segment = self.segment_class(self.seq_num, msg_S)
+                segment_bytes = self.current_segment.to_bytes()
                 self.network.network_send(segment_bytes)
                 print(f"\nSend message {self.seq_num}")
                 
                 # Change state to waiting for ACK
                 self.sender_state = 'S_B'
                 self.send_time = time()
+                self.retransmitted = False
+                self._start_timer(self.send_time, self.seq_num)
                 
                 return True
             
@@ -113,44 +279,99 @@ class SWRDT:
             
         # is Reciever sending ACK
         else: 
-            ack_segment = Segment(msg_S, "")
-            self.network.network_send(ack_segment.get_byte_S())
+            ack_segment = self.segment_class.ack(msg_S)
+            self.network.network_send(ack_segment.to_bytes())
             return True
                 
 
 
-    def swrdt_receive(self):
-        byte_S = self.network.network_receive()
-        self.byte_buffer += byte_S
-        
+    def swrdt_receive(self, timeout=0):
+        # Returns the next delivered message (receiver) or "ACK_RECEIVED" (sender), None if there was none in time
+        # timeout=0 only handles what already arrived, None blocks until there is a result
+        deadline = None if timeout is None else time() + timeout
+        while True:
+            result = self._poll()
+            if result is not None or self._idle() or (deadline is not None and time() >= deadline):
+                return result
+            # sleep until the collector signals new data, the deadline, or the next retransmission is due
+            self.network.wait(self._wait_time(deadline))
+
+
+    def _poll(self):
+        # Retransmit whatever timed out, then handle buffered segments until one gives a result
+        self._fire_timers()
+        self.byte_buffer.append(self.network.network_receive())
+        while True:
+            buffered = len(self.byte_buffer)
+            result = self._handle_segment()
+            # stop if nothing was consumed too, handling the same segment again would never end
+            if result is not None or len(self.byte_buffer) == buffered or not self._segment_buffered():
+                return result
+
+
+    def _idle(self):
+        # Waiting cannot produce a result: the sender has nothing in flight, or the peer is gone
+        if self.role == "sender" and self.all_acked():
+            return True
+        return self.network.closed and not self._segment_buffered()
+
+
+    def _wait_time(self, deadline):
+        # Seconds until the deadline or the next retransmission, whichever is first, None if neither is set
+        now = time()
+        waits = [moment - now for moment in (deadline, self._next_timeout()) if moment is not None]
+        return max(0, min(waits)) if waits else None
+
+
+    def _segment_buffered(self):
+        with self.byte_buffer.peek() as view:
+            length = self.segment_class.frame_length(view)
+        return length is not None and len(self.byte_buffer) >= length
+
+
+    def _handle_segment(self):
         if self.role == "receiver":
+            if self.mode == "sr":
+                return self._sr_receiver_receive()
+            # stop-and-wait and Go-Back-N receivers both deliver in order and acknowledge cumulatively
             return self._receiver_receive()
+        elif self.mode != "sw":
+            return self._window_sender_receive()
         else:
             return self._sender_receive()
 
 
-    def _receiver_receive(self):
+    def all_acked(self):
+        # True once every message handed to swrdt_send has been acknowledged
+        if self.mode == "sw":
+            return self.current_segment is None
+        return not self.unacked
 
-        # Check if we have enough bytes to read segment length
-        if len(self.byte_buffer) < Segment.length_S_length:
-            return None
-            
-        # Extract length of segment
-        length = int(self.byte_buffer[:Segment.length_S_length])
+
+    def _next_segment(self):
+        # Remove and return the next complete segment in the buffer, or None if it has not fully arrived
+
+        # Extract length of segment, once enough bytes arrived to read it
+        with self.byte_buffer.peek() as view:
+            length = self.segment_class.frame_length(view)
 
         # Not enough bytes to read the whole segment
-        if len(self.byte_buffer) < length:
-            return None  
-            
-        segment_bytes = self.byte_buffer[:length]
-        segment_data = self.byte_buffer[Segment.length_S_length:length]
-        
-        # remove the Segment bytes from the buffer
-        self.byte_buffer = self.byte_buffer[length:]
+        if length is None or len(self.byte_buffer) < length:
+            return None
+
+        # copy the Segment bytes out and remove them from the buffer
+        return self.byte_buffer.read(length)
+
+
+    def _receiver_receive(self):
+
+        segment_bytes = self._next_segment()
+        if segment_bytes is None:
+            return None
         
         try:
             # Try to create segment from bytes
-            segment = Segment.from_byte_S(segment_bytes)
+            segment = self.segment_class.from_bytes(segment_bytes)
             
             # Expected segment --> deliver to application
             if segment.seq_num == self.expected_seq_num:
@@ -174,40 +395,25 @@ class SWRDT:
 
     def _sender_receive(self):
 
-        # Not waiting for ACK
+        # Not waiting for ACK --> a late duplicate ACK, drop it
         if self.sender_state != 'S_B':
-            return None  
-            
-        # Check for timeout
-        if time() - self.send_time > self.timeout_duration:
-            print(f"Timeout! Resend message {self.seq_num}")
-            self.network.network_send(self.current_segment.get_byte_S())
-            self.send_time = time()
+            self._next_segment()
             return None
             
-        # Check if we have enough bytes to read segment length
-        if len(self.byte_buffer) < Segment.length_S_length:
+        segment_bytes = self._next_segment()
+        if segment_bytes is None:
             return None
-            
-        # Extract length of segment
-        length = int(self.byte_buffer[:Segment.length_S_length])
-
-        
-        if len(self.byte_buffer) < length:
-            return None  
-            
-        segment_bytes = self.byte_buffer[:length]
-        
-        # remove the Segment bytes from the buffer
-        self.byte_buffer = self.byte_buffer[length:]
         
         try:
             # Try to create segment from bytes
-            segment = Segment.from_byte_S(segment_bytes)
+            segment = self.segment_class.from_bytes(segment_bytes)
             
             # Valid ACK  recieved --> should have empty message and sequence number matching our expected ACK
-            if segment.msg_S == "" and int(segment.seq_num) == self.seq_num:
+            if segment.is_ack() and int(segment.seq_num) == self.seq_num:
                 print(f"Receive ACK {segment.seq_num}. Message successfully sent!")
+                if not self.retransmitted:
+                    self.rto.sample(time() - self.send_time)
+                self.rto.acknowledged()
                 self.seq_num += 1
                 self.sender_state = 'S_A'
                 self.current_segment = None
@@ -221,10 +427,222 @@ class SWRDT:
         # ACK is corrupted  
         except RuntimeError:
             print(f"Corruption detected in ACK. Resend message {self.seq_num}")
-            self.network.network_send(self.current_segment.get_byte_S())
+            self.network.network_send(self.current_segment.to_bytes())
             self.send_time = time()
+            self.retransmitted = True
+            self._start_timer(self.send_time, self.seq_num)
+            return None
+
+
+
+    def _window_send(self, msg_S):
+        # Go-Back-N / Selective Repeat: send right away as long as the window has room
+        base = next(iter(self.unacked), self.seq_num)
+        if self.seq_num >= base + self.window_size:
+            return False
+
+        segment = self.segment_class(self.seq_num, msg_S)
+        self.network.network_send(segment.to_bytes())
+        print(f"\nSend message {self.seq_num}")
+        now = time()
+        self.unacked[self.seq_num] = [segment, now, False]
+        if self.mode == "sr":
+            self._start_timer(now, self.seq_num)
+        elif self.timer_start is None:
+            self.timer_start = now
+            self._start_timer(now)
+        self.seq_num += 1
+
+        # S_B now means the window is full
+        self.sender_state = 'S_B' if self.seq_num >= base + self.window_size else 'S_A'
+        return True
+
+
+    def _start_timer(self, sent, seq_num=None):
+        heapq.heappush(self.timers, (sent, seq_num))
+
+
+    def _timer_running(self, sent, seq_num):
+        # False for an entry whose timer was stopped by an ACK or restarted by a later send
+        if self.mode == "sr":
+            return seq_num in self.unacked and self.unacked[seq_num][1] == sent
+        if self.mode == "gbn":
+            return self.timer_start == sent
+        return self.sender_state == 'S_B' and seq_num == self.seq_num and self.send_time == sent
+
+
+    def _next_timeout(self):
+        # Time the earliest running timer expires, None if none is running
+        # all timers share one RTO, so the earliest sent is also the first to expire
+        while self.timers and not self._timer_running(*self.timers[0]):
+            heapq.heappop(self.timers)
+        return self.timers[0][0] + self.rto.rto if self.timers else None
+
+
+    def _fire_timers(self):
+        now = time()
+        expired = []
+        while True:
+            due = self._next_timeout()
+            if due is None or due > now:
+                break
+            expired.append(heapq.heappop(self.timers)[1])
+        if not expired:
+            return
+        # back off once per expiry, not once per segment that happened to expire together
+        self.rto.backoff()
+
+        if self.mode == "sw":
+            print(f"Timeout! Resend message {self.seq_num} (RTO now {self.rto.rto:.3f} s)")
+            self.network.network_send(self.current_segment.to_bytes())
+            self.send_time = now
+            self.retransmitted = True
+            self._start_timer(now, self.seq_num)
+        elif self.mode == "gbn":
+            # the oldest segment timed out: go back and resend everything in flight
+            print(f"Timeout! Resend messages {', '.join(str(seq) for seq in self.unacked)}"
+                  f" (RTO now {self.rto.rto:.3f} s)")
+            for entry in self.unacked.values():
+                self.network.network_send(entry[0].to_bytes())
+                entry[1] = now
+                entry[2] = True
+            self.timer_start = now
+            self._start_timer(now)
+        else:
+            # every segment has its own timer, only the ones that expired are resent
+            for seq in expired:
+                entry = self.unacked[seq]
+                print(f"Timeout! Resend message {seq} (RTO now {self.rto.rto:.3f} s)")
+                self.network.network_send(entry[0].to_bytes())
+                entry[1] = now
+                entry[2] = True
+                self._start_timer(now, seq)
+
+
+    def _window_sender_receive(self):
+
+        segment_bytes = self._next_segment()
+        if segment_bytes is None:
+            return None
+
+        try:
+            segment = self.segment_class.from_bytes(segment_bytes)
+        # ACK is corrupted --> nothing to do, the timers recover from it
+        except RuntimeError:
+            print("Corruption detected in ACK. Ignored")
+            return None
+
+        ack = int(segment.seq_num)
+        if self.mode == "gbn":
+            # cumulative: everything up to and including ack has arrived
+            acked = [seq for seq in self.unacked if seq <= ack]
+        else:
+            acked = [ack] if ack in self.unacked else []
+
+        if not segment.is_ack() or not acked:
+            print(f"Receive ACK {ack}. Ignored")
+            return None
+
+        # Karn's rule: only a segment sent exactly once gives an unambiguous RTT
+        # a cumulative ACK may cover several, the most recently sent one is the tightest sample
+        sent_once = [self.unacked[seq][1] for seq in acked if not self.unacked[seq][2]]
+        if sent_once:
+            self.rto.sample(time() - max(sent_once))
+        self.rto.acknowledged()
+        for seq in acked:
+            del self.unacked[seq]
+        print(f"Receive ACK {ack}. Message successfully sent!")
+
+        if self.mode == "gbn":
+            self.timer_start = time() if self.unacked else None
+            if self.timer_start is not None:
+                self._start_timer(self.timer_start)
+        self.sender_state = 'S_A'
+        return "ACK_RECEIVED"
+
+
+    def _sr_receiver_receive(self):
+
+        # messages released by an earlier segment that filled a gap
+        if self.ready:
+            return self.ready.popleft()
+
+        segment_bytes = self._next_segment()
+        if segment_bytes is None:
+            return None
+
+        try:
+            segment = self.segment_class.from_bytes(segment_bytes)
+        # Segment is corrupted --> drop it, the sender retransmits it when its timer expires
+        except RuntimeError:
+            print("Corruption detected! Ignored")
             return None
 
+        seq = segment.seq_num
+        if self.expected_seq_num <= seq < self.expected_seq_num + self.window_size:
+            print(f"Receive message {seq}. Send ACK {seq}")
+            self.swrdt_send(str(seq))
+            self.out_of_order[seq] = segment.msg_S
+            # deliver everything that is now in order
+            while self.expected_seq_num in self.out_of_order:
+                self.ready.append(self.out_of_order.pop(self.expected_seq_num))
+                self.expected_seq_num += 1
+            return self.ready.popleft() if self.ready else None
+
+        # Already delivered --> our ACK was lost, acknowledge it again
+        if self.expected_seq_num - self.window_size <= seq < self.expected_seq_num:
+            print(f"Receive message {seq}. Send ACK {seq}")
+            self.swrdt_send(str(seq))
+        return None
+
+
+
+class AsyncSWRDT(SWRDT):
+    # asyncio interface: await send() / recv() suspend the task rather than blocking a thread
+    # NetworkLayer's collector thread still reads the socket, it wakes the event loop through on_data
+
+    @classmethod
+    async def open(cls, *args, **kwargs):
+        # Same arguments as SWRDT, connecting (or accepting) runs in an executor so the loop is not blocked
+        loop = asyncio.get_running_loop()
+        swrdt = await loop.run_in_executor(None, lambda: cls(*args, **kwargs))
+        swrdt.data_ready = asyncio.Event()
+        swrdt.network.on_data = lambda: swrdt._wake(loop)
+        # data that arrived before on_data was set
+        swrdt.data_ready.set()
+        return swrdt
+
+    def _wake(self, loop):
+        try:
+            loop.call_soon_threadsafe(self.data_ready.set)
+        # the loop was closed without disconnecting
+        except RuntimeError:
+            pass
+
+    async def send(self, msg_S):
+        # Sends msg_S, waiting for ACKs while the window is full
+        while not self.swrdt_send(msg_S):
+            await self.recv()
+
+    async def recv(self, timeout=None):
+        # The awaitable swrdt_receive: next message (receiver) or "ACK_RECEIVED" (sender), None after timeout
+        deadline = None if timeout is None else time() + timeout
+        while True:
+            # cleared before polling, so data collected while polling sets it again
+            self.data_ready.clear()
+            result = self._poll()
+            if result is not None or self._idle() or (deadline is not None and time() >= deadline):
+                return result
+            try:
+                await asyncio.wait_for(self.data_ready.wait(), self._wait_time(deadline))
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self):
+        # Waits until every message sent has been acknowledged
+        while not self.all_acked():
+            await self.recv()
+
 
 
 
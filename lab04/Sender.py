@@ -1,6 +1,5 @@
 import argparse
 import SWRDT
-import time
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -8,6 +7,11 @@ if __name__ == "__main__":
     )
     parser.add_argument("receiver", help="receiver.")
     parser.add_argument("port", help="Port.", type=int)
+    parser.add_argument("--mode", help="Stop-and-wait, Go-Back-N or Selective Repeat.",
+                        choices=SWRDT.SWRDT.modes, default="sw")
+    parser.add_argument("--window", help="Window size of the pipelined modes.", type=int, default=8)
+    parser.add_argument("--format", help="Segment wire format, text with MD5 or binary with CRC32.",
+                        choices=list(SWRDT.SWRDT.wire_formats), default="text")
     args = parser.parse_args()
 
     msg_L = [
@@ -23,32 +27,19 @@ if __name__ == "__main__":
         "sending message - 10",
     ]
 
-    swrdt = SWRDT.SWRDT("sender", args.receiver, args.port)
+    swrdt = SWRDT.SWRDT("sender", args.receiver, args.port, args.mode, args.window, args.format)
     
     for msg_S in msg_L:
         
-        # Send message (will only work if in S_A state)
-        if swrdt.swrdt_send(msg_S):
+        # Send message (only works while the window has room, a window of one in stop-and-wait)
+        while not swrdt.swrdt_send(msg_S):
 
-            # Wait for ACK
-            ack_received = False
-            while not ack_received:
-                result = swrdt.swrdt_receive()
-                if result == "ACK_RECEIVED":
-                    ack_received = True
+            # Window full --> block until an ACK (or a retransmission) moves it along
+            swrdt.swrdt_receive(timeout=None)
 
-                
-                time.sleep(0.1)
-        else:
-            print("Cannot send message - waiting for previous ACK")
-
-            # Wait until we can send again
-            while swrdt.sender_state != 'S_A':
-                swrdt.swrdt_receive()
-                time.sleep(0.1)
-
-            # Retry sending
-            swrdt.swrdt_send(msg_S)
+    # Wait until every message has been acknowledged
+    while not swrdt.all_acked():
+        swrdt.swrdt_receive(timeout=None)
 
     swrdt.disconnect()
     print("\n--- End ---")
\ No newline at end of file